@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""Throughput benchmark for clianer/util/col.py.
+
+Generates synthetic tab-separated corpora and runs col.py on them around
+`cat` and a few CPU-bound stand-in filters. For every run, lines/s, MB/s,
+peak RSS of col.py and the maximum depth of its batch queue are printed and
+appended as a JSON line to the output file, so runs can be compared over time.
+
+Example:
+    python benchmarks/bench_col.py --lines 1M,10M --columns 2,4 \\
+        --charset ascii,mixed --child cat,lower --jobs 1,4
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COL_PY = os.path.join(ROOT, "clianer", "util", "col.py")
+
+# Alphabets words are built from, per charset
+CHARSETS = {
+    "ascii": "abcdefghijklmnopqrstuvwxyz",
+    "latin": "abcdefghijklmnopqrstuvwxyzáčďéěíňóřšťúůýžäöüß",
+    "cyrillic": "абвгдеёжзийклмнопрстуфхцчшщъыьэюя",
+    "cjk": "的一是不了人我在有他这中大来上国个到说们为子和你地出道也时年",
+    "emoji": "😀😂🥲😍🤔👍🙏🎉🔥✨",
+}
+CHARSETS["mixed"] = "".join(CHARSETS.values())
+
+# Stand-in filters: line-in/line-out commands of increasing CPU cost
+CHILDREN = {
+    "cat": ["cat"],
+    "lower": [sys.executable, "-c",
+              "import sys\n"
+              "for line in sys.stdin: sys.stdout.write(line.lower())"],
+    "regex": [sys.executable, "-c",
+              "import re, sys\n"
+              "pattern = re.compile(r'(\\w+)\\s+(\\w+)')\n"
+              "for line in sys.stdin: sys.stdout.write(pattern.sub(r'\\2 \\1', line))"],
+    "hash": [sys.executable, "-c",
+             "import hashlib, sys\n"
+             "for line in sys.stdin:\n"
+             "    digest = line.encode()\n"
+             "    for _ in range(20): digest = hashlib.sha256(digest).digest()\n"
+             "    sys.stdout.write(line)"],
+}
+
+# Number of distinct lines generated, the corpus repeats them
+UNIQUE_LINES = 10000
+
+# Final statistics line of col.py --log-interval
+STATS_RE = re.compile(r"max (\d+) \(([\d.]+) MiB\)")
+
+
+def parse_count(text):
+    """Parses counts like 1M or 500k."""
+    units = {"k": 10**3, "m": 10**6, "g": 10**9}
+    if text[-1:].lower() in units:
+        return int(float(text[:-1]) * units[text[-1:].lower()])
+    return int(text)
+
+
+def parse_list(cast):
+    return lambda text: [cast(item) for item in text.split(",")]
+
+
+def make_line(rng, alphabet, columns, line_length):
+    fields = []
+    for _ in range(columns):
+        words = []
+        length = 0
+        while length < line_length:
+            word = "".join(rng.choices(alphabet, k=rng.randint(1, 10)))
+            words.append(word)
+            length += len(word) + 1
+        fields.append(" ".join(words))
+    return "\t".join(fields) + "\n"
+
+
+def generate_corpus(path, lines, columns, line_length, charset, seed=1):
+    """Writes a corpus of `lines` lines, unless it already exists."""
+    if os.path.exists(path):
+        return
+
+    rng = random.Random(seed)
+    alphabet = CHARSETS[charset]
+    block = "".join(
+        make_line(rng, alphabet, columns, line_length)
+        for _ in range(min(lines, UNIQUE_LINES))).encode()
+
+    with open(path + ".part", "wb") as fout:
+        for _ in range(lines // UNIQUE_LINES):
+            fout.write(block)
+        remainder = lines % UNIQUE_LINES
+        if remainder:
+            fout.write(b"".join(block.splitlines(keepends=True)[:remainder]))
+
+    os.rename(path + ".part", path)
+
+
+def run_col(path, child, jobs, extra_args):
+    """Runs col.py on column 0 of the corpus and returns wall time, peak RSS
+    of col.py in bytes and the maximum queue depth and size it reported."""
+    command = [sys.executable, COL_PY, "--log-interval", "86400",
+               "--jobs", str(jobs), *extra_args, "0", *CHILDREN[child]]
+
+    with open(path, "rb") as fin, tempfile.TemporaryFile() as ferr:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdin=fin,
+                                   stdout=subprocess.DEVNULL, stderr=ferr)
+        _, status, rusage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        ferr.seek(0)
+        stderr = ferr.read().decode(errors="replace")
+
+    if process.returncode != 0:
+        raise RuntimeError(f"col.py exited with {process.returncode}: {stderr}")
+
+    match = STATS_RE.search(stderr)
+    depth, depth_mb = (int(match[1]), float(match[2])) if match else (None, None)
+
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak_rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+    return elapsed, peak_rss, depth, depth_mb
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=parse_list(parse_count), default=[10**6],
+                        help="comma-separated corpus sizes, e.g. 1M,50M (default: 1M)")
+    parser.add_argument("--columns", type=parse_list(int), default=[2],
+                        help="comma-separated column counts (default: 2)")
+    parser.add_argument("--line-length", type=parse_list(int), default=[60],
+                        help="comma-separated approximate field lengths in characters (default: 60)")
+    parser.add_argument("--charset", type=parse_list(str), default=["ascii", "mixed"],
+                        help=f"comma-separated charsets out of {', '.join(CHARSETS)} (default: ascii,mixed)")
+    parser.add_argument("--child", type=parse_list(str), default=["cat", "lower"],
+                        help=f"comma-separated stand-in filters out of {', '.join(CHILDREN)} (default: cat,lower)")
+    parser.add_argument("--jobs", type=parse_list(int), default=[1],
+                        help="comma-separated col.py --jobs values (default: 1)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per configuration, the fastest is reported (default: %(default)s)")
+    parser.add_argument("--col-args", default="",
+                        help="extra arguments for col.py, e.g. '--mmap'")
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "clianer-bench"),
+                        help="where generated corpora are kept between runs (default: %(default)s)")
+    parser.add_argument("--output", default=os.path.join(ROOT, "bench_output.txt"),
+                        help="file the results are appended to as JSON lines (default: %(default)s)")
+    args = parser.parse_args()
+
+    for charset in args.charset:
+        if charset not in CHARSETS:
+            parser.error(f"unknown charset: {charset}")
+    for child in args.child:
+        if child not in CHILDREN:
+            parser.error(f"unknown child: {child}")
+
+    os.makedirs(args.corpus_dir, exist_ok=True)
+    revision = git_revision()
+    extra_args = args.col_args.split()
+
+    print(f"{'lines':>10} {'cols':>4} {'len':>4} {'charset':>8} {'child':>6} {'jobs':>4}"
+          f" {'lines/s':>10} {'MB/s':>7} {'RSS MB':>7} {'depth':>5}")
+
+    with open(args.output, "a") as fout:
+        for lines, columns, line_length, charset in itertools.product(
+                args.lines, args.columns, args.line_length, args.charset):
+            path = os.path.join(
+                args.corpus_dir, f"{lines}x{columns}x{line_length}-{charset}.tsv")
+            generate_corpus(path, lines, columns, line_length, charset)
+            size = os.path.getsize(path)
+
+            for child, jobs in itertools.product(args.child, args.jobs):
+                runs = [run_col(path, child, jobs, extra_args)
+                        for _ in range(args.repeat)]
+                elapsed, peak_rss, depth, depth_mb = min(runs)
+
+                result = {
+                    "benchmark": "col",
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "revision": revision,
+                    "lines": lines,
+                    "columns": columns,
+                    "line_length": line_length,
+                    "charset": charset,
+                    "bytes": size,
+                    "child": child,
+                    "jobs": jobs,
+                    "col_args": extra_args,
+                    "seconds": elapsed,
+                    "lines_per_sec": lines / elapsed,
+                    "mb_per_sec": size / elapsed / 2**20,
+                    "peak_rss_mb": max(run[1] for run in runs) / 2**20,
+                    "max_queue_depth": depth,
+                    "max_queue_mb": depth_mb,
+                }
+                fout.write(json.dumps(result) + "\n")
+                fout.flush()
+
+                print(f"{lines:>10} {columns:>4} {line_length:>4} {charset:>8} {child:>6} {jobs:>4}"
+                      f" {result['lines_per_sec']:>10.0f} {result['mb_per_sec']:>7.1f}"
+                      f" {result['peak_rss_mb']:>7.1f} {depth if depth is not None else '-':>5}")
+
+
+if __name__ == "__main__":
+    main()
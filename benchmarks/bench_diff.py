@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""Scaling benchmark for bitext diffs and their rendering.
+
+Builds synthetic revision pairs like the ones filters produce and times the
+diff (`diff_bitexts`, or `track_origins` with `diff_bitexts_by_origin`) and
+`DatasetView.show_diff` together with rendering its first screen, for a range
+of sample sizes. For every method and scenario, the times are printed as a
+scaling curve together with the growth exponent between successive sizes, so
+quadratic behavior stands out. Results are also appended as JSON lines to the
+output file.
+
+Example:
+    python benchmarks/bench_diff.py --sizes 100,1k,10k,100k --intraline
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from clianer.util.diff import (
+    DIFF_ENGINES, bitext_rows, diff_bitexts, diff_bitexts_by_origin,
+    track_origins)
+from clianer.widgets.dataset_view import DatasetView
+
+
+WORDS = ("the of and to in is that for it as was with be by on not he this "
+         "are or his from at which but have an they you were her she there "
+         "had been one all we can has their if more will would").split()
+
+# Screen size used for rendering the dataset view
+SCREEN_SIZE = (160, 50)
+
+# Growth exponent between two sizes above which the curve is flagged
+SUPERLINEAR_EXPONENT = 1.5
+
+
+def sentence(rng, words):
+    return " ".join(rng.choices(WORDS, k=words)).capitalize() + "."
+
+
+def make_sample(rng, size, words=12):
+    src = [sentence(rng, words) for _ in range(size)]
+    tgt = [sentence(rng, words) for _ in range(size)]
+    return src, tgt
+
+
+def normalize(rng, line):
+    """Small in-place edit, like punctuation or whitespace normalization."""
+    words = line.split(" ")
+    i = rng.randrange(len(words))
+    words[i] = words[i].upper()
+    return "  ".join(words) if rng.random() < 0.5 else " ".join(words)
+
+
+def deletions(rng, src, tgt):
+    """A tenth of the rows removed, like most filters do."""
+    keep = [rng.random() >= 0.1 for _ in src]
+    return ([s for s, k in zip(src, keep) if k],
+            [t for t, k in zip(tgt, keep) if k])
+
+
+def normalizations(rng, src, tgt):
+    """A third of the rows modified in place."""
+    return ([normalize(rng, s) if rng.random() < 0.3 else s for s in src],
+            [normalize(rng, t) if rng.random() < 0.3 else t for t in tgt])
+
+
+def mixed(rng, src, tgt):
+    """Rows removed, modified and a few added."""
+    src2, tgt2 = [], []
+    for s, t in zip(src, tgt):
+        p = rng.random()
+        if p < 0.1:
+            continue
+        if p < 0.3:
+            s, t = normalize(rng, s), normalize(rng, t)
+        src2.append(s)
+        tgt2.append(t)
+        if rng.random() < 0.01:
+            src2.append(sentence(rng, 12))
+            tgt2.append(sentence(rng, 12))
+    return src2, tgt2
+
+
+def long_lines(rng, src, tgt):
+    """Modifications of very long lines."""
+    return normalizations(rng, src, tgt)
+
+
+# Name: (words per sentence, revision builder)
+SCENARIOS = {
+    "deletions": (12, deletions),
+    "normalizations": (12, normalizations),
+    "mixed": (12, mixed),
+    "long-lines": (800, long_lines),
+}
+
+METHODS = [*DIFF_ENGINES, "origins"]
+
+
+def make_revisions(scenario, size, seed=1):
+    rng = random.Random(seed)
+    words, builder = SCENARIOS[scenario]
+    src, tgt = make_sample(rng, size, words)
+    return (src, tgt), builder(rng, src, tgt)
+
+
+def run_diff(method, rev1, rev2, intraline):
+    """Returns the time of the diff alone, of `DatasetView.show_diff` (which
+    includes the diff) and of rendering the first screen of the view."""
+    start = time.perf_counter()
+    if method == "origins":
+        rows1 = bitext_rows(*rev1)
+        origins = (list(range(len(rows1))),
+                   track_origins(rows1, list(range(len(rows1))),
+                                 bitext_rows(*rev2)))
+        diff_bitexts_by_origin(rev1[0], rev1[1], origins[0],
+                               rev2[0], rev2[1], origins[1],
+                               intraline=intraline)
+    else:
+        origins = None
+        diff_bitexts(*rev1, *rev2, engine=method, intraline=intraline)
+    diff_time = time.perf_counter() - start
+
+    view = DatasetView()
+    view.intraline = intraline
+    start = time.perf_counter()
+    view.show_diff(*rev1, *rev2, origins=origins)
+    show_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    view.render(SCREEN_SIZE, focus=True)
+    render_time = time.perf_counter() - start
+
+    return diff_time, show_time, render_time
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_count(text):
+    """Parses counts like 10k or 1M."""
+    units = {"k": 10**3, "m": 10**6}
+    if text[-1:].lower() in units:
+        return int(float(text[:-1]) * units[text[-1:].lower()])
+    return int(text)
+
+
+def exponent(size1, time1, size2, time2):
+    if min(time1, time2) <= 0:
+        return None
+    return math.log(time2 / time1) / math.log(size2 / size1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,1k,10k,100k",
+                        help="comma-separated sample sizes (default: %(default)s)")
+    parser.add_argument("--scenario", default=",".join(SCENARIOS),
+                        help="comma-separated scenarios (default: %(default)s)")
+    parser.add_argument("--method", default="patience,origins",
+                        help=f"comma-separated methods out of {', '.join(METHODS)} (default: %(default)s)")
+    parser.add_argument("--intraline", action="store_true",
+                        help="highlight changed parts of modified lines")
+    parser.add_argument("--time-limit", type=float, default=30,
+                        help="skip larger sizes once a run takes longer than this many seconds (default: %(default)s)")
+    parser.add_argument("--output", default=os.path.join(ROOT, "bench_output.txt"),
+                        help="file the results are appended to as JSON lines (default: %(default)s)")
+    args = parser.parse_args()
+
+    sizes = sorted(parse_count(size) for size in args.sizes.split(","))
+    scenarios = args.scenario.split(",")
+    methods = args.method.split(",")
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"unknown scenario: {scenario}")
+    for method in methods:
+        if method not in METHODS:
+            parser.error(f"unknown method: {method}")
+
+    revision = git_revision()
+    flagged = []
+
+    # Warm up imports and urwid caches so they don't skew the smallest size
+    run_diff(methods[0], *make_revisions(scenarios[0], 100), args.intraline)
+
+    with open(args.output, "a") as fout:
+        for scenario, method in itertools.product(scenarios, methods):
+            print(f"{scenario} / {method}{' / intraline' if args.intraline else ''}")
+            print(f"{'rows':>8} {'diff s':>9} {'show s':>9} {'render s':>9}"
+                  f" {'us/row':>8} {'exponent':>8}")
+
+            previous = None
+            for size in sizes:
+                rev1, rev2 = make_revisions(scenario, size)
+                diff_time, show_time, render_time = run_diff(
+                    method, rev1, rev2, args.intraline)
+                # curve of all three, so superlinear growth in any is caught
+                total = diff_time + show_time + render_time
+
+                growth = None
+                if previous is not None:
+                    growth = exponent(*previous, size, total)
+                    if growth is not None and growth > SUPERLINEAR_EXPONENT:
+                        flagged.append((scenario, method, previous[0], size, growth))
+                previous = (size, total)
+
+                fout.write(json.dumps({
+                    "benchmark": "diff",
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "revision": revision,
+                    "scenario": scenario,
+                    "method": method,
+                    "intraline": args.intraline,
+                    "rows": size,
+                    "diff_seconds": diff_time,
+                    "show_seconds": show_time,
+                    "render_seconds": render_time,
+                    "exponent": growth,
+                }) + "\n")
+                fout.flush()
+
+                print(f"{size:>8} {diff_time:>9.4f} {show_time:>9.4f} {render_time:>9.4f}"
+                      f" {total / size * 1e6:>8.1f}"
+                      f" {'' if growth is None else f'{growth:.2f}':>8}")
+
+                if total > args.time_limit:
+                    print(f"  stopping, over the {args.time_limit}s time limit")
+                    break
+            print()
+
+    for scenario, method, size1, size2, growth in flagged:
+        print(f"superlinear: {scenario} / {method} grows as n^{growth:.2f}"
+              f" between {size1} and {size2} rows")
+
+    if flagged:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
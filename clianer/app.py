@@ -1,13 +1,13 @@
 #!/usr/bin/env python3
 
+import asyncio
 import urwid
 import gzip
 import os
 import sys
 
+from clianer.util.filters import get_filter_catalogue
 from clianer.widgets.main_frame import ClianerFrame
-from opuscleaner.filters import set_global_filters, list_filters
-from opuscleaner.config import FILTER_PATH
 
 
 PALETTE = [(None,  "light gray", "dark blue"),
@@ -22,6 +22,8 @@ PALETTE = [(None,  "light gray", "dark blue"),
            ("filter selected", "black", "dark cyan"),
            ("filter diff", "light green,bold", "dark blue"),
            ("filter diff selected", "light green,bold", "dark cyan"),
+           ("filter slow", "yellow,bold", "dark blue"),
+           ("filter slow selected", "yellow,bold", "dark cyan"),
            ("shadow", "white", "black"),
            ("dialog shadow corner", "", ""),
            ("dialog heading", "yellow", "dark cyan"),
@@ -34,8 +36,8 @@ PALETTE = [(None,  "light gray", "dark blue"),
            ("edit", "black", "dark cyan"),
            ("data", "black", "light gray"),
            ("focus data", "black", "dark cyan"),
-           ("diffminus", "black", "light red"),
-           ("diffplus", "black", "light green"),
+           ("diffminus", "white,bold", "dark red"),
+           ("diffplus", "white,bold", "dark green"),
            ("diffminus whole", "black", "light red"),
            ("diffplus whole", "black ", "light green"),
            ]
@@ -60,7 +62,22 @@ class App:
         self.args = args
         self.main_frame = ClianerFrame()
 
-        set_global_filters(list_filters(FILTER_PATH))
+        get_filter_catalogue().install()
 
     def run(self):
-        urwid.MainLoop(self.main_frame, PALETTE).run()
+        event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(event_loop)
+
+        main_loop = urwid.MainLoop(
+            self.main_frame, PALETTE,
+            event_loop=urwid.AsyncioEventLoop(loop=event_loop))
+        self.main_frame.main_loop = main_loop
+
+        try:
+            main_loop.run()
+        finally:
+            # save edits still waiting for the debounce, then kill filters
+            # that may still be running
+            self.main_frame.flush_filters_update()
+            event_loop.run_until_complete(self.main_frame.stop_loading())
+            event_loop.close()
@@ -0,0 +1,188 @@
+"""Headless mode: run the saved filter pipelines over whole datasets.
+
+Each dataset is cleaned by OpusCleaner's `opuscleaner.clean` with the pipeline
+saved in the app, and its output is gzipped to a file in the output directory.
+Output is first written to a `.part` file and renamed once the dataset is
+done, so an interrupted run can be resumed: datasets whose output exists and
+is newer than their pipeline are skipped.
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
+
+from opuscleaner.config import DATA_PATH
+from opuscleaner.datasets import list_datasets, filter_configuration_path
+
+
+logger = logging.getLogger(__name__)
+
+# Bytes of cleaned output read at once when counting lines
+CHUNK_SIZE = 1 << 20
+
+# Seconds between progress messages of a single dataset
+PROGRESS_INTERVAL = 30
+
+
+def resolve_datasets(names: List[str], category: Optional[str]) -> List[str]:
+    """Dataset names given on the command line plus those in the category."""
+    datasets = list(names)
+
+    if category is not None:
+        # imports OpusCleaner's web app, which the app itself does not need
+        # on startup
+        from opuscleaner.categories import get_mapping
+
+        mapping = get_mapping()
+        if category not in mapping.mapping:
+            known = ", ".join(c.name for c in mapping.categories)
+            raise ValueError(f"unknown category {category} (known: {known})")
+        datasets.extend(mapping.mapping[category])
+
+    available = list_datasets(DATA_PATH)
+    for name in datasets:
+        if name not in available:
+            raise ValueError(f"unknown dataset {name}")
+
+    # keep the order, drop duplicates
+    return list(dict.fromkeys(datasets))
+
+
+def output_path(output_dir: str, name: str, langs: List[str]) -> str:
+    return os.path.join(output_dir, f"{name}.{'-'.join(langs)}.tsv.gz")
+
+
+def clean_dataset(name: str, output_dir: str, threads: int = 1,
+                  force: bool = False) -> Optional[int]:
+    """Run the saved pipeline of the dataset over all of it.
+
+    Returns the number of lines written, or `None` if the dataset was
+    skipped.
+    """
+    pipeline_path = filter_configuration_path(name)
+    if not os.path.exists(pipeline_path):
+        logger.warning("%s: no saved pipeline, skipping", name)
+        return None
+
+    langs = [lang for lang, _ in list_datasets(DATA_PATH)[name]]
+
+    path = output_path(output_dir, name, langs)
+    if (not force and os.path.exists(path)
+            and os.path.getmtime(path) >= os.path.getmtime(pipeline_path)):
+        logger.info("%s: %s is up to date, skipping", name, path)
+        return None
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial_path = path + ".part"
+
+    logger.info("%s: cleaning into %s", name, path)
+    start = last_report = time.monotonic()
+    lines = 0
+
+    with open(partial_path, "wb") as fout:
+        gzip = subprocess.Popen(["gzip", "-c"], stdin=subprocess.PIPE,
+                                stdout=fout)
+        clean = subprocess.Popen(
+            [sys.executable, "-m", "opuscleaner.clean",
+             "--parallel", str(threads), pipeline_path],
+            stdout=subprocess.PIPE)
+
+        try:
+            # pass the output through to count lines for the progress
+            while True:
+                chunk = clean.stdout.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                lines += chunk.count(b"\n")
+                gzip.stdin.write(chunk)
+
+                now = time.monotonic()
+                if now - last_report >= PROGRESS_INTERVAL:
+                    last_report = now
+                    logger.info("%s: %d lines (%.0f lines/s)", name, lines,
+                                lines / (now - start))
+        finally:
+            clean.stdout.close()
+            gzip.stdin.close()
+            clean_status = clean.wait()
+            gzip_status = gzip.wait()
+
+    if clean_status != 0 or gzip_status != 0:
+        raise RuntimeError(
+            f"{name}: cleaning failed with status {clean_status or gzip_status}, "
+            f"partial output left in {partial_path}")
+
+    os.replace(partial_path, path)
+
+    elapsed = time.monotonic() - start
+    logger.info("%s: done, %d lines in %.1fs (%.0f lines/s)", name, lines,
+                elapsed, lines / elapsed if elapsed else 0)
+    return lines
+
+
+def run(args) -> int:
+    """Entry point of the `run` subcommand. Returns the exit status."""
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(message)s", stream=sys.stderr)
+
+    try:
+        datasets = resolve_datasets(args.datasets, args.category)
+    except ValueError as e:
+        logger.error("%s", e)
+        return 1
+
+    if not datasets:
+        logger.error("no datasets given")
+        return 1
+
+    failed = 0
+
+    # The work is done by the cleaning subprocesses, threads only wait on them
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {
+            executor.submit(clean_dataset, name, args.output_dir,
+                            args.threads, args.force): name
+            for name in datasets}
+
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error("%s", e)
+                failed += 1
+
+    logger.info("%d datasets, %d failed", len(datasets), failed)
+    return 1 if failed else 0
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {number}")
+    return number
+
+
+def add_arguments(parser) -> None:
+    parser.add_argument(
+        "datasets", metavar="DATASET", nargs="*",
+        help="names of the datasets to clean")
+    parser.add_argument(
+        "--category", "-c",
+        help="also clean all datasets assigned to this category")
+    parser.add_argument(
+        "--output-dir", "-o", default=".",
+        help="directory to write the cleaned datasets to (default: %(default)s)")
+    parser.add_argument(
+        "--jobs", "-j", type=positive_int, default=os.cpu_count() or 1,
+        help="number of datasets cleaned at once (default: %(default)s)")
+    parser.add_argument(
+        "--threads", "-t", type=positive_int, default=1,
+        help="parallel copies of the pipeline per dataset (default: %(default)s)")
+    parser.add_argument(
+        "--force", "-f", action="store_true",
+        help="clean datasets again even if their output is up to date")
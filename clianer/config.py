@@ -0,0 +1,8 @@
+import os
+
+# Directory for persistent caches of the app, such as the dataset catalogue.
+CACHE_PATH = os.getenv(
+    "CLIANER_CACHE_PATH",
+    os.path.join(
+        os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+        "clianer"))
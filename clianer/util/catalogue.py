@@ -0,0 +1,268 @@
+"""Cached catalogue of the datasets in `DATA_PATH`.
+
+Listing the datasets means globbing the data directory and reading the saved
+pipeline of every dataset, which is slow on network filesystems. The
+catalogue keeps the result in memory and in an index file under
+`CACHE_PATH`, and only redoes the parts whose files changed since:
+
+- the data directory is globbed again only if the modification time of one
+  of the directories containing datasets (or their parents) changed,
+- a pipeline file is read again only if its modification time changed,
+- the category mapping is read again only if its modification time changed.
+
+`Catalogue.refresh_iter()` does this step by step, so that a caller running it
+in a background thread can show the datasets while the rest is still being
+checked.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from opuscleaner.config import CATEGORIES_PATH, DATA_PATH
+from opuscleaner.datasets import list_datasets, filter_configuration_path
+
+from clianer.config import CACHE_PATH
+
+
+# Bump when the layout of the index file changes
+INDEX_VERSION = 1
+
+# Number of pipeline files checked between two updates of `refresh_iter()`
+PIPELINE_BATCH_SIZE = 50
+
+
+class DatasetEntry(NamedTuple):
+    name: str
+    langs: List[str] # in the order of the columns
+    filter_count: Optional[int] # None if the pipeline was not checked yet
+    categorized: bool
+
+
+def _mtime(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _count_filters(path: str) -> int:
+    """Number of steps of a saved pipeline, without validating it."""
+    try:
+        with open(path) as fh:
+            data = json.load(fh)
+    except (OSError, ValueError):
+        return 0
+
+    if isinstance(data, dict):
+        return len(data.get("filters", []))
+    if isinstance(data, list):
+        # pipelines used to be saved as a plain list of steps
+        return len(data)
+    return 0
+
+
+class Catalogue:
+
+    def __init__(self, index_path: Optional[str] = None):
+        if index_path is None:
+            # one index per data path, several may share the cache directory
+            digest = hashlib.sha1(DATA_PATH.encode()).hexdigest()[:16]
+            index_path = os.path.join(CACHE_PATH, f"catalogue-{digest}.json")
+
+        self.index_path = index_path
+        self.loaded = False
+
+        # directory -> mtime, for all directories the datasets were found in
+        self.dirs: Dict[str, Optional[float]] = {}
+        # dataset name -> list of (lang, path)
+        self.datasets: Dict[str, List[Tuple[str, str]]] = {}
+        # dataset name -> (mtime of the pipeline file, number of steps)
+        self.pipelines: Dict[str, Tuple[Optional[float], int]] = {}
+        self.categories_mtime: Optional[float] = None
+        self.categorized: List[str] = []
+
+        # Refreshes replace the attributes above instead of changing them in
+        # place, so `entries()` can be called while a refresh is running.
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        self.loaded = True
+        try:
+            with open(self.index_path) as fh:
+                index = json.load(fh)
+        except (OSError, ValueError):
+            return
+
+        if index.get("version") != INDEX_VERSION \
+                or index.get("data_path") != DATA_PATH:
+            return
+
+        self.dirs = index["dirs"]
+        self.datasets = {
+            name: [tuple(file) for file in files]
+            for name, files in index["datasets"].items()}
+        self.pipelines = {
+            name: tuple(pipeline)
+            for name, pipeline in index["pipelines"].items()}
+        self.categories_mtime = index["categories_mtime"]
+        self.categorized = index["categorized"]
+
+    def save(self) -> None:
+        index = {
+            "version": INDEX_VERSION,
+            "data_path": DATA_PATH,
+            "dirs": self.dirs,
+            "datasets": self.datasets,
+            "pipelines": self.pipelines,
+            "categories_mtime": self.categories_mtime,
+            "categorized": self.categorized,
+        }
+
+        # the index is only a cache, failing to write it is not an error
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(self.index_path + ".tmp", "w") as fh:
+                json.dump(index, fh)
+            os.replace(self.index_path + ".tmp", self.index_path)
+        except OSError:
+            pass
+
+    def _dirs_changed(self) -> bool:
+        return not self.dirs or any(
+            _mtime(path) != mtime for path, mtime in self.dirs.items())
+
+    def _scan(self) -> None:
+        root = Path(DATA_PATH.split("*")[0])
+        datasets = {
+            name: [(lang, str(path)) for lang, path in files]
+            for name, files in list_datasets(DATA_PATH).items()}
+
+        # a new dataset (or directory of them) changes the mtime of the
+        # directory it was added to
+        dirs = {str(root)}
+        for files in datasets.values():
+            for _, path in files:
+                parent = Path(path).parent
+                while parent not in (root, parent.parent):
+                    dirs.add(str(parent))
+                    parent = parent.parent
+
+        self.dirs = {path: _mtime(path) for path in sorted(dirs)}
+        self.datasets = datasets
+
+    def entries(self) -> List[DatasetEntry]:
+        """Datasets as currently known, without checking any files."""
+        if not self.loaded:
+            self.load()
+
+        datasets, pipelines = self.datasets, self.pipelines
+        categorized = set(self.categorized)
+        return [
+            DatasetEntry(name, [lang for lang, _ in files],
+                         pipelines[name][1] if name in pipelines else None,
+                         name in categorized)
+            for name, files in datasets.items()]
+
+    def refresh_iter(self, force: bool = False) -> Iterator[List[DatasetEntry]]:
+        """Bring the catalogue up to date, yielding its datasets each time
+        some of them changed.
+
+        With `force`, the data directory is globbed again even if none of
+        the known directories changed. The lock is only held while a step
+        runs, not while the caller handles what was yielded.
+        """
+        changed = False
+        try:
+            for step in self._refresh_steps(force):
+                with self.lock:
+                    step_changed = step()
+                if step_changed:
+                    changed = True
+                    yield self.entries()
+        finally:
+            # also keep what was done when the caller stopped early
+            if changed:
+                with self.lock:
+                    self.save()
+
+    def _refresh_steps(self, force: bool) -> Iterator[Callable[[], bool]]:
+        """Steps of `refresh_iter()`, each returning whether it changed the
+        catalogue. Each one is run before the next is made, so the pipeline
+        steps see the datasets found by the first."""
+        yield lambda: self._refresh_datasets(force)
+        yield self._refresh_categories
+
+        names = list(self.datasets)
+        for start in range(0, len(names), PIPELINE_BATCH_SIZE):
+            yield lambda batch=names[start:start + PIPELINE_BATCH_SIZE]: \
+                self._refresh_pipelines(batch)
+
+    def _refresh_datasets(self, force: bool) -> bool:
+        if not self.loaded:
+            self.load()
+
+        changed = False
+        if force or self._dirs_changed():
+            self._scan()
+            changed = True
+
+        if self.pipelines.keys() - self.datasets.keys():
+            self.pipelines = {
+                name: pipeline
+                for name, pipeline in self.pipelines.items()
+                if name in self.datasets}
+            changed = True
+
+        return changed
+
+    def _refresh_categories(self) -> bool:
+        categories_mtime = _mtime(CATEGORIES_PATH)
+        if categories_mtime == self.categories_mtime:
+            return False
+
+        # imports OpusCleaner's web app, so not done on startup
+        from opuscleaner.categories import get_mapping
+
+        mapping = get_mapping()
+        self.categorized = sorted({
+            name
+            for category in mapping.categories
+            for name in mapping.mapping.get(category.name, [])})
+        self.categories_mtime = categories_mtime
+        return True
+
+    def _refresh_pipelines(self, names: List[str]) -> bool:
+        updated = {}
+        for name in names:
+            path = filter_configuration_path(name)
+            mtime = _mtime(path)
+            cached = self.pipelines.get(name)
+            if cached is None or cached[0] != mtime:
+                count = _count_filters(path) if mtime is not None else 0
+                updated[name] = (mtime, count)
+
+        if not updated:
+            return False
+        self.pipelines = {**self.pipelines, **updated}
+        return True
+
+    def refresh(self, force: bool = False) -> List[DatasetEntry]:
+        """Bring the catalogue up to date and return its datasets."""
+        for _ in self.refresh_iter(force):
+            pass
+        return self.entries()
+
+
+_catalogue: Optional[Catalogue] = None
+
+
+def get_catalogue() -> Catalogue:
+    """The catalogue shared by the whole app"""
+    global _catalogue
+    if _catalogue is None:
+        _catalogue = Catalogue()
+    return _catalogue
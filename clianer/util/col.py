@@ -1,12 +1,44 @@
 #!/usr/bin/env python3
+"""Runs a line-in/line-out filter on selected columns of tab-separated input.
+
+Usage: col.py [--jobs N] [--queue-size N] [--max-memory SIZE]
+              [--log-interval SECONDS] [--mmap] COLUMNS COMMAND...
+
+With --jobs N, N copies of COMMAND are started and batches of lines are
+dealt to them round-robin. The output keeps the order of the input.
+
+The number (and size) of batches which were read but not yet written out is
+bounded, so reading blocks when COMMAND falls behind. COMMAND may hold back
+the output of a batch (e.g. in its stdio buffer) until it gets more input,
+so the bound always leaves room for the next two batches of every job
+besides the one being merged. With a small --max-memory, the batches are
+made smaller (down to MIN_BATCH_SIZE, which is bigger than stdio buffers).
+
+With --mmap, input that is a regular file is memory-mapped and cut into
+batches directly from the mapping instead of being read line by line.
+"""
+import argparse
+import mmap
+import os
+import stat
 import sys
 from subprocess import Popen, PIPE
-from threading import Thread
+from collections import deque
+from threading import Condition, Event, Thread
 from queue import SimpleQueue
-from typing import BinaryIO, Optional, TypeVar, List
+from itertools import chain, islice
+from typing import BinaryIO, Generic, Iterable, Iterator, Optional, TypeVar, List, Tuple
+
 
+# Subprocess the batch was sent to, number of lines and the passthrough
+# fields, column by column.
+Batch = Tuple[int, int, List[List[bytes]]]
 
-queue = SimpleQueue() # type: SimpleQueue[None|list[bytes]]
+# Approximate number of bytes of input that are split or merged at once.
+BATCH_SIZE = 1 << 18
+
+# Smallest batch size --max-memory can bring it down to.
+MIN_BATCH_SIZE = 1 << 16
 
 T = TypeVar("T")
 
@@ -20,6 +52,73 @@ def parse_columns(text:str) -> List[int]:
 	return sorted(int(col) for col in text.split(','))
 
 
+def parse_size(text:str) -> int:
+	"""Parses sizes like 512M or 2G into bytes."""
+	units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+	if text[-1:].upper() in units:
+		return int(float(text[:-1]) * units[text[-1:].upper()])
+	return int(text)
+
+
+class BoundedQueue(Generic[T]):
+	"""FIFO queue that blocks `put()` while it holds `maxsize` items or
+	`maxbytes` bytes worth of items. An item is always accepted by an empty
+	queue, however big it is. Once closed, `put()` never blocks and drops
+	the items, so producers can't get stuck after the consumer failed."""
+
+	def __init__(self, maxsize:int, maxbytes:int):
+		self.maxsize = maxsize
+		self.maxbytes = maxbytes
+		self.items = deque() # type: deque[Tuple[T,int]]
+		self.bytes = 0
+		self.closed = False
+		self.max_depth = 0
+		self.max_bytes = 0
+		self.blocked = 0 # number of times put() had to wait
+		self.cond = Condition()
+
+	def _has_room(self, size:int) -> bool:
+		return self.closed or not self.items or (
+			len(self.items) < self.maxsize and self.bytes + size <= self.maxbytes)
+
+	def put(self, item:T, size:int=0) -> None:
+		with self.cond:
+			if not self._has_room(size):
+				self.blocked += 1
+				while not self._has_room(size):
+					self.cond.wait()
+
+			if self.closed:
+				return
+
+			self.items.append((item, size))
+			self.bytes += size
+			self.max_depth = max(self.max_depth, len(self.items))
+			self.max_bytes = max(self.max_bytes, self.bytes)
+			self.cond.notify_all()
+
+	def get(self) -> T:
+		with self.cond:
+			while not self.items:
+				self.cond.wait()
+
+			item, size = self.items.popleft()
+			self.bytes -= size
+			self.cond.notify_all()
+			return item
+
+	def close(self) -> None:
+		with self.cond:
+			self.closed = True
+			self.cond.notify_all()
+
+	def stats(self) -> str:
+		with self.cond:
+			return (f'in-flight batches: {len(self.items)} ({self.bytes / (1 << 20):.1f} MiB),'
+				f' max {self.max_depth} ({self.max_bytes / (1 << 20):.1f} MiB),'
+				f' reader blocked {self.blocked} times')
+
+
 class RaisingThread(Thread):
 	"""Thread that will raise any uncaught exceptions in the thread in the
 	parent once it joins again."""
@@ -39,20 +138,95 @@ class RaisingThread(Thread):
 			raise self.exception
 
 
-def split(columns:List[int], queue:'SimpleQueue[None|list[bytes]]', fin:BinaryIO, fout:BinaryIO):
+def column_plan(columns:List[int], field_count:int) -> List[Tuple[bool,int]]:
+	"""For each output column, whether it comes from the subprocess and its
+	index among the subprocess or passthrough columns."""
+	passthru_columns = [n for n in range(field_count) if n not in columns]
+	return [
+		(True, columns.index(n)) if n in columns else (False, passthru_columns.index(n))
+		for n in range(field_count)
+	]
+
+
+# Every byte except the field and line separators, see _check_fields()
+_NOT_SEPARATORS = bytes(n for n in range(256) if n not in b'\t\n')
+
+
+def _strip_lines(lines:List[bytes]) -> bytes:
+	"""Joins lines into a single buffer with every line ending in a single b'\\n'"""
+	data = b''.join(lines)
+	if b'\r' in data:
+		# Slow path, only strip line endings, not \r inside fields.
+		return b''.join(line.rstrip(b'\r\n') + b'\n' for line in lines)
+	if data and not data.endswith(b'\n'):
+		data += b'\n'
+	return data
+
+
+def read_batches(fin:BinaryIO, batch_size:int=BATCH_SIZE) -> Iterator[bytes]:
+	"""Batches of whole lines read from a stream."""
+	while True:
+		lines = fin.readlines(batch_size)
+		if not lines:
+			break
+		yield _strip_lines(lines)
+
+
+def map_input(fin:BinaryIO) -> Optional[mmap.mmap]:
+	"""Memory-maps `fin` if it is a non-empty regular file."""
 	try:
-		field_count = None
-		passthru_columns = []
-		for line in fin:
-			fields = line.rstrip(b'\r\n').split(b'\t')
-			if field_count is None:
-				field_count = len(fields)
-				passthru_columns = [n for n in range(field_count) if n not in columns]
-			elif field_count != len(fields):
+		fileno = fin.fileno()
+		info = os.fstat(fileno)
+	except (OSError, ValueError):
+		return None
+	if not stat.S_ISREG(info.st_mode) or info.st_size == 0:
+		return None
+	# Start at the current position, something might have read from it already
+	offset = os.lseek(fileno, 0, os.SEEK_CUR)
+	if offset >= info.st_size:
+		return None
+	mapping = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+	mapping.seek(offset)
+	return mapping
+
+
+def mapped_batches(mapping:mmap.mmap, batch_size:int=BATCH_SIZE) -> Iterator[bytes]:
+	"""Batches of whole lines cut from a memory-mapped file. Each batch is a
+	single copy out of the mapping; there are no per-line objects."""
+	start, size = mapping.tell(), len(mapping)
+	while start < size:
+		end = mapping.find(b'\n', start + batch_size)
+		end = size if end == -1 else end + 1
+		data = mapping[start:end]
+		if b'\r' in data:
+			data = _strip_lines(data.splitlines(keepends=True))
+		elif not data.endswith(b'\n'):
+			data += b'\n'
+		yield data
+		start = end
+
+
+def _check_fields(data:bytes, field_count:int) -> int:
+	"""Checks every line of the batch has `field_count` fields. Returns the
+	number of lines."""
+	line_count = data.count(b'\n')
+	# Only the separators, should be the same pattern for every line
+	if data.translate(None, _NOT_SEPARATORS) != (b'\t' * (field_count - 1) + b'\n') * line_count:
+		for line in data[:-1].split(b'\n'):
+			fields = line.split(b'\t')
+			if len(fields) != field_count:
 				raise RuntimeError(f'line contains a different number of fields: {len(fields)} vs {field_count}')
-			queue.put([fields[column] for column in passthru_columns])
-			for column in columns:
-				fout.write(fields[column] + b'\n')
+	return line_count
+
+
+def feed(shard:'SimpleQueue[None|bytes]', fout:BinaryIO):
+	"""Writes the input of a single subprocess."""
+	try:
+		while True:
+			data = shard.get()
+			if data is None:
+				break
+			fout.write(data)
 	except BrokenPipeError:
 		pass
 	finally:
@@ -60,61 +234,173 @@ def split(columns:List[int], queue:'SimpleQueue[None|list[bytes]]', fin:BinaryIO
 			fout.close() # might fail if BrokenPipeError
 		except:
 			pass
+
+
+def split(columns:List[int], queue:'BoundedQueue[None|Batch]', batches:Iterable[bytes], shards:'List[SimpleQueue[None|bytes]]'):
+	try:
+		batch_index = 0
+		field_count = None
+		passthru_columns = []
+		for data in batches:
+			if field_count is None:
+				field_count = data[:data.index(b'\n')].count(b'\t') + 1
+				passthru_columns = [n for n in range(field_count) if n not in columns]
+				if columns[-1] >= field_count:
+					raise RuntimeError(f'column {columns[-1]} out of range, line contains {field_count} fields')
+
+			line_count = _check_fields(data, field_count)
+
+			shard = batch_index % len(shards)
+			batch_index += 1
+
+			if field_count == 1:
+				# Whole lines go to the subprocess, no need to split them
+				queue.put((shard, line_count, []), len(data))
+				shards[shard].put(data)
+				continue
+
+			# All fields of the batch, row by row
+			fields = data[:-1].replace(b'\n', b'\t').split(b'\t')
+
+			queue.put((shard, line_count, [fields[column::field_count] for column in passthru_columns]), len(data))
+
+			if len(columns) == 1:
+				shards[shard].put(b'\n'.join(fields[columns[0]::field_count]) + b'\n')
+			else:
+				shards[shard].put(b'\n'.join(chain.from_iterable(zip(*(fields[column::field_count] for column in columns)))) + b'\n')
+	finally:
+		for shard_queue in shards:
+			shard_queue.put(None)
 		queue.put(None) # End indicator
-		fin.close()
 
 
-def merge(columns:List[int], queue:'SimpleQueue[None|list[bytes]]', fin:BinaryIO, fout:BinaryIO):
+def merge(columns:List[int], queue:'BoundedQueue[None|Batch]', fins:List[BinaryIO], fout:BinaryIO):
 	try:
+		plan = None
 		while True:
-			passthru_fields = queue.get()
-			if passthru_fields is None:
-				if fin.readline() != b'':
+			batch = queue.get()
+			if batch is None:
+				if any(fin.readline() != b'' for fin in fins):
 					raise RuntimeError('subprocess produced more lines of output than it was given')
 				break
 
-			passthru_it = iter(passthru_fields)
-			for column in range(len(passthru_fields) + len(columns)):
-				if column in columns:
-					field = fin.readline()
-					if field == b'':
-						raise RuntimeError('subprocess produced fewer lines than it was given')
-					field = field.rstrip(b'\r\n')
-				else:
-					field = next(passthru_it)
-
-				if column > 0:
-					fout.write(b'\t')
-				fout.write(field)
-			fout.write(b'\n')
+			shard, line_count, passthru = batch
+			fin = fins[shard]
+
+			if plan is None:
+				plan = column_plan(columns, len(passthru) + len(columns))
+
+			lines = list(islice(fin, line_count * len(columns)))
+			if len(lines) < line_count * len(columns):
+				raise RuntimeError('subprocess produced fewer lines than it was given')
+
+			if not passthru and len(columns) == 1:
+				# Output is the subprocess output as is
+				fout.write(_strip_lines(lines))
+				continue
+
+			fields = _strip_lines(lines)[:-1].split(b'\n')
+
+			output = [
+				fields[index::len(columns)] if from_child else passthru[index]
+				for from_child, index in plan
+			]
+
+			fout.write(b'\n'.join(map(b'\t'.join, zip(*output))) + b'\n')
 	except BrokenPipeError:
 		pass
 	finally:
+		queue.close() # unblocks split() if we stopped early
 		fout.close()
-		fin.close()
+		for fin in fins:
+			fin.close()
+
+
+def min_in_flight(jobs:int) -> int:
+	"""Batches that must fit in the queue: the one being merged and the next
+	two of every job, plus one as batches end a line past their size."""
+	return 2 * jobs + 2
+
+
+def batch_size_for(max_memory:int, jobs:int) -> int:
+	"""Size of the batches for which `min_in_flight()` of them fit in
+	`max_memory`. Raises ValueError if that is below `MIN_BATCH_SIZE`."""
+	batch_size = min(BATCH_SIZE, max_memory // min_in_flight(jobs))
+	if batch_size < MIN_BATCH_SIZE:
+		raise ValueError(f'--max-memory must be at least {min_in_flight(jobs) * MIN_BATCH_SIZE} bytes with {jobs} jobs')
+	return batch_size
+
+
+def log_stats(queue:BoundedQueue, interval:float, stop:Event):
+	while not stop.wait(interval):
+		print(f'col.py: {queue.stats()}', file=sys.stderr)
 
 
 def main():
 	retval = 0
 
+	parser = argparse.ArgumentParser(description='Runs COMMAND on COLUMNS of tab-separated input')
+	parser.add_argument('--jobs', '-j', type=int, default=1, help='number of copies of COMMAND to run in parallel (default: %(default)s)')
+	parser.add_argument('--queue-size', type=int, default=64, help='maximum number of batches read but not yet written out (default: %(default)s, at least 2 per job and 2 more)')
+	parser.add_argument('--max-memory', type=parse_size, default='256M', help='maximum size of batches read but not yet written out, e.g. 512M or 2G (default: %(default)s)')
+	parser.add_argument('--log-interval', type=float, default=0, help='print queue statistics to stderr every this many seconds (default: never)')
+	parser.add_argument('--mmap', action='store_true', help='memory-map the input if it is a regular file')
+	parser.add_argument('columns', type=parse_columns, help='comma-separated list of column indices (0-based)')
+	parser.add_argument('command', nargs=argparse.REMAINDER)
+	args = parser.parse_args()
+
+	if args.jobs < 1:
+		parser.error('--jobs must be at least 1')
+
+	try:
+		batch_size = batch_size_for(args.max_memory, args.jobs)
+	except ValueError as e:
+		parser.error(str(e))
+
+	queue = BoundedQueue(max(args.queue_size, min_in_flight(args.jobs)), args.max_memory) # type: BoundedQueue[None|Batch]
+
+	stop_logging = Event()
+	if args.log_interval > 0:
+		Thread(target=log_stats, args=[queue, args.log_interval, stop_logging], daemon=True).start()
+
 	try:
-		columns = parse_columns(sys.argv[1])
+		children = [Popen(args.command, stdin=PIPE, stdout=PIPE) for _ in range(args.jobs)]
 
-		child = Popen(sys.argv[2:], stdin=PIPE, stdout=PIPE)
+		shards = [SimpleQueue() for _ in children] # type: List[SimpleQueue[None|bytes]]
 
-		feeder = RaisingThread(target=split, args=[columns, queue, sys.stdin.buffer, none_throws(child).stdin])
-		feeder.start()
+		feeders = [
+			RaisingThread(target=feed, args=[shard, none_throws(child.stdin)])
+			for shard, child in zip(shards, children)
+		]
+		for feeder in feeders:
+			feeder.start()
 
-		consumer = RaisingThread(target=merge, args=[columns, queue, none_throws(child).stdout, sys.stdout.buffer])
+		mapping = map_input(sys.stdin.buffer) if args.mmap else None
+		batches = mapped_batches(mapping, batch_size) if mapping is not None else read_batches(sys.stdin.buffer, batch_size)
+
+		splitter = RaisingThread(target=split, args=[args.columns, queue, batches, shards])
+		splitter.start()
+
+		consumer = RaisingThread(target=merge, args=[args.columns, queue, [none_throws(child.stdout) for child in children], sys.stdout.buffer])
 		consumer.start()
 
-		retval = child.wait()
-		
-		if retval != 0:
-			raise RuntimeError(f'subprocess exited with status code {retval}')
+		for child in children:
+			retval = child.wait()
+			if retval != 0:
+				raise RuntimeError(f'subprocess exited with status code {retval}')
 
-		feeder.join()
+		splitter.join()
+		for feeder in feeders:
+			feeder.join()
 		consumer.join()
+
+		if mapping is not None:
+			mapping.close()
+		sys.stdin.close()
+
+		if args.log_interval > 0:
+			stop_logging.set()
+			print(f'col.py: {queue.stats()}', file=sys.stderr)
 	except Exception as e:
 		print(f'Error: {e}', file=sys.stderr)
 		sys.exit(retval or 1)
@@ -0,0 +1,210 @@
+"""Decompressed copies of whole datasets, for browsing all of their rows.
+
+For each language file of a dataset, the cache keeps the decompressed text
+and the offsets of the starts of all its lines (as 64-bit integers, followed
+by the size of the text). Both are memory-mapped when browsing, so getting any
+row is a lookup of two offsets and a slice, and the memory used only depends
+on the rows being looked at.
+
+The copies are as big as the uncompressed dataset. They are kept under
+`CACHE_PATH` and made again when a file of the dataset changes. A copy is
+made in a directory of its own and moved into place once it is complete, so
+a cancelled copy never touches the files of another one.
+"""
+
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+from array import array
+from itertools import accumulate
+from typing import Callable, Dict, List, Optional, Sequence
+
+from opuscleaner.config import DATA_PATH
+from opuscleaner.datasets import list_datasets
+
+from clianer.config import CACHE_PATH
+
+
+# Bump when the layout of the cache changes
+CACHE_VERSION = 1
+
+# Bytes decompressed at once while building the cache
+READ_SIZE = 4 * 1024 * 1024
+
+
+def _source(path: str) -> Dict[str, object]:
+    stat = os.stat(path)
+    return {"path": path, "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def _map(path: str):
+    """Read-only memory map of the file, or empty bytes for an empty file"""
+    with open(path, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _copy_lines(src: str, text_path: str, offsets_path: str,
+                progress: Callable[[int], None],
+                cancel: Optional[threading.Event]) -> bool:
+    """Decompress `src` to `text_path`, writing the offsets of its lines to
+    `offsets_path`. Returns False if cancelled."""
+    with open(src, "rb") as raw, \
+            open(text_path, "wb") as text, \
+            open(offsets_path, "wb") as offsets:
+        fh = gzip.GzipFile(fileobj=raw) if src.endswith(".gz") else raw
+
+        array("Q", [0]).tofile(offsets)
+        size = 0
+        last = b"\n"
+        for data in iter(lambda: fh.read(READ_SIZE), b""):
+            if cancel is not None and cancel.is_set():
+                return False
+
+            # the start of each line is one past the end of the previous
+            lines = data.split(b"\n")[:-1]
+            array("Q", accumulate(
+                map((1).__add__, map(len, lines)), initial=size))[1:] \
+                .tofile(offsets)
+
+            text.write(data)
+            size += len(data)
+            last = data[-1:]
+            progress(raw.tell())
+
+        if last != b"\n":
+            # so the offset after the last line is also one past its end
+            text.write(b"\n")
+            array("Q", [size + 1]).tofile(offsets)
+
+    return True
+
+
+class CorpusRows(Sequence):
+    """Rows of a cached dataset, decoded when asked for.
+
+    The rows are dicts from language to text, same as in the samples. If the
+    files have different numbers of lines, the extra lines are left out.
+    """
+
+    def __init__(self, directory: str, langs: List[str]) -> None:
+        self.langs = langs
+        self.texts = []
+        self.offsets = []
+        self.maps = []
+        for i in range(len(langs)):
+            self.texts.append(_map(os.path.join(directory, f"{i}.txt")))
+            self.maps.append(_map(os.path.join(directory, f"{i}.offsets")))
+            self.offsets.append(memoryview(self.maps[-1]).cast("Q"))
+
+        self.length = min(len(offsets) - 1 for offsets in self.offsets)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("row index out of range")
+
+        return {
+            lang: text[offsets[index]:offsets[index + 1] - 1].decode(
+                "utf-8", errors="replace")
+            for lang, text, offsets in zip(self.langs, self.texts, self.offsets)}
+
+    def close(self) -> None:
+        for offsets in self.offsets:
+            offsets.release()
+        for data in self.texts + self.maps:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+
+class CorpusCache:
+    """The cached copy of a dataset, see the module docstring"""
+
+    def __init__(self, dataset: str) -> None:
+        self.dataset = dataset
+        columns = list_datasets(DATA_PATH)[dataset]
+        self.langs = [lang for lang, _ in columns]
+        self.paths = [str(path) for _, path in columns]
+
+        digest = hashlib.sha1(
+            f"{DATA_PATH}\0{dataset}".encode()).hexdigest()[:16]
+        self.directory = os.path.join(CACHE_PATH, "corpus", digest)
+
+    def _manifest(self) -> dict:
+        return {
+            "version": CACHE_VERSION,
+            "dataset": self.dataset,
+            "langs": self.langs,
+            "sources": [_source(path) for path in self.paths],
+        }
+
+    def is_built(self) -> bool:
+        try:
+            with open(os.path.join(self.directory, "manifest.json")) as fh:
+                return json.load(fh) == self._manifest()
+        except (OSError, ValueError):
+            return False
+
+    def build(self, progress: Optional[Callable[[float], None]] = None,
+              cancel: Optional[threading.Event] = None) -> bool:
+        """Make the copy, calling `progress` with the fraction done so far.
+        Returns False if cancelled by setting `cancel`."""
+        manifest = self._manifest()
+        total = sum(source["size"] for source in manifest["sources"]) or 1
+
+        parent = os.path.dirname(self.directory)
+        os.makedirs(parent, exist_ok=True)
+        building = tempfile.mkdtemp(
+            prefix=os.path.basename(self.directory) + ".", dir=parent)
+
+        try:
+            done = 0
+            for i, path in enumerate(self.paths):
+                def file_progress(position, done=done):
+                    if progress is not None:
+                        progress((done + position) / total)
+
+                if not _copy_lines(
+                        path, os.path.join(building, f"{i}.txt"),
+                        os.path.join(building, f"{i}.offsets"),
+                        file_progress, cancel):
+                    return False
+                done += manifest["sources"][i]["size"]
+
+            with open(os.path.join(building, "manifest.json"), "w") as fh:
+                json.dump(manifest, fh)
+
+            # a directory cannot be renamed over a non-empty one, the old
+            # copy is moved aside first (open rows of it stay readable)
+            old = tempfile.mkdtemp(
+                prefix=os.path.basename(self.directory) + ".", dir=parent)
+            try:
+                os.replace(self.directory, old)
+            except FileNotFoundError:
+                pass
+            try:
+                os.replace(building, self.directory)
+            except OSError:
+                # another copy was moved into place in the meantime
+                if not self.is_built():
+                    raise
+            shutil.rmtree(old, ignore_errors=True)
+            return True
+        finally:
+            shutil.rmtree(building, ignore_errors=True)
+
+    def open(self) -> CorpusRows:
+        return CorpusRows(self.directory, self.langs)
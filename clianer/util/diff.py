@@ -1,8 +1,17 @@
 #!/usr/bin/env python3
-"""Diffing module based on Python difflib"""
+"""Diffing module for bitexts.
 
-from difflib import Differ
-from typing import List, Tuple, Optional, Iterable
+Line alignment is done by pluggable engines which produce `Differ`-style
+lines ("  ", "- ", "+ " and "? " prefixes). These are then turned into the
+markup shown by the dataset view.
+"""
+
+import re
+import time
+from bisect import bisect_left
+from difflib import Differ, SequenceMatcher
+from os.path import commonprefix
+from typing import Callable, Dict, List, Tuple, Optional, Iterable
 
 
 Markup = List[Tuple[Optional[str],str]]
@@ -17,6 +26,49 @@ DIFF_MINUS = "diffminus"
 DIFF_PLUS_WHOLE = "diffplus whole"
 DIFF_PLUS = "diffplus"
 
+DiffEngine = Callable[[List[str], List[str]], Iterable[str]]
+
+# Gaps between anchors with no unique common lines are aligned by difflib if
+# they have at most this many line pairs, and treated as replaced otherwise.
+GAP_ALIGN_LIMIT = 10000
+
+# Replaced blocks with at most this many line pairs get their lines paired by
+# similarity; larger ones are shown as plain deletions followed by insertions.
+FUZZY_PAIR_LIMIT = 2500
+
+# Blocks are only paired until this many seconds were spent on pairing in a
+# single diff, the ones after that are shown as deletions and insertions too
+# (and, when tracking origins, paired by position or unchanged side only).
+FUZZY_PAIR_TIME_BUDGET = 0.5
+
+# Intra-line diffs of a single row are only computed if the product of the
+# token counts of the changed parts does not exceed this...
+INTRALINE_TOKEN_BUDGET = 20000
+
+# ...and only until this many seconds were spent on a single diff. Rows over
+# the budget fall back to whole-line highlighting.
+INTRALINE_TIME_BUDGET = 0.5
+
+# Modified rows sharing less than this fraction of characters are highlighted
+# as whole lines since a character diff would be mostly noise.
+INTRALINE_MIN_RATIO = 0.3
+
+_TOKEN_RE = re.compile(r"\w+|\s+|[^\w\s]")
+
+# Minimum similarity for two lines to be considered a modification of each
+# other (same as in difflib.Differ).
+FUZZY_PAIR_CUTOFF = 0.75
+
+# Lines are compared by their words and punctuation rather than by characters
+# as Differ does: sentences share most of their characters in any order, so
+# the quick upper bounds of the ratio rule out next to nothing, and the exact
+# ratio of characters takes quadratic time.
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+# Similarity of lines with more words is estimated from the words they share
+# regardless of order.
+FUZZY_RATIO_MAX_WORDS = 200
+
 
 def clean_hunk_markup(state: str, hunk: List[str]) -> BitextDiff:
     if state == " ":
@@ -157,33 +209,467 @@ def _parse_difflines(difflines: Iterable[DiffLine]) -> Iterable[BitextDiff]:
         yield process_hunk(hunk_state, hunk_content)
 
 
-def diff_bitexts(rev1_src: List[str], rev1_tgt: List[str],
-                 rev2_src: List[str], rev2_tgt: List[str]) -> BitextDiff:
-    """Bitext diff, respecting the number of items in revisions.
+def _unique_matches(a: List[str], alo: int, ahi: int,
+                    b: List[str], blo: int, bhi: int) -> List[Tuple[int, int]]:
+    """Longest increasing sequence of lines occurring exactly once in both
+    ranges, as a list of (i, j) index pairs (patience diff anchors)."""
+    a_index: Dict[str, Optional[int]] = {}
+    for i in range(alo, ahi):
+        a_index[a[i]] = None if a[i] in a_index else i
+
+    b_index: Dict[str, Optional[int]] = {}
+    for j in range(blo, bhi):
+        if a_index.get(b[j]) is not None:
+            b_index[b[j]] = None if b[j] in b_index else j
+
+    # candidates ordered by j, find the longest increasing run of i's
+    candidates = [(a_index[line], j) for line, j in b_index.items()
+                  if j is not None]
+
+    tails: List[int] = []  # smallest i ending an increasing run of length k
+    tail_ids: List[int] = []
+    backrefs: List[int] = []
+    for k, (i, _) in enumerate(candidates):
+        pos = bisect_left(tails, i)
+        backrefs.append(tail_ids[pos - 1] if pos > 0 else -1)
+        if pos == len(tails):
+            tails.append(i)
+            tail_ids.append(k)
+        else:
+            tails[pos] = i
+            tail_ids[pos] = k
 
-    Do not assume anything about the diff - most general diff for filters
-    which add, remove or change lines.
+    anchors = []
+    k = tail_ids[-1] if tail_ids else -1
+    while k >= 0:
+        anchors.append(candidates[k])
+        k = backrefs[k]
+
+    anchors.reverse()
+    return anchors
+
+
+def _matching_lines(a: List[str], b: List[str]) -> List[Tuple[int, int]]:
+    """Sorted (i, j) pairs of lines aligned as equal.
 
-    Try to guess which lines have been changed - this is delegated to the
-    Python Differ class
+    Common prefixes and suffixes are matched first, the rest is split on
+    unique common lines (patience diff). Small gaps without any unique
+    common line are aligned by difflib, large ones are left unaligned.
     """
-    assert len(rev1_src) == len(rev1_tgt)
-    assert len(rev2_src) == len(rev2_tgt)
+    matches = []
+    ranges = [(0, len(a), 0, len(b))]
+
+    while ranges:
+        alo, ahi, blo, bhi = ranges.pop()
+
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            matches.append((ahi, bhi))
+
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchors = _unique_matches(a, alo, ahi, b, blo, bhi)
+        if anchors:
+            for i, j in anchors:
+                ranges.append((alo, i, blo, j))
+                matches.append((i, j))
+                alo, blo = i + 1, j + 1
+            ranges.append((alo, ahi, blo, bhi))
+
+        elif (ahi - alo) * (bhi - blo) <= GAP_ALIGN_LIMIT:
+            matcher = SequenceMatcher(
+                None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for i, j, size in matcher.get_matching_blocks():
+                matches.extend(
+                    (alo + i + k, blo + j + k) for k in range(size))
+
+    matches.sort()
+    return matches
+
+
+def _side_pairs(a: List[str], b: List[str]) -> List[Tuple[int, int]]:
+    """Greedily pair lines which have one side unchanged"""
+    positions: Dict[Tuple[int, str], List[int]] = {}
+    for i, line in enumerate(a):
+        src, _, tgt = line.partition("\t")
+        positions.setdefault((0, src), []).append(i)
+        positions.setdefault((1, tgt), []).append(i)
+
+    pairs = []
+    ia = 0
+    for j, line in enumerate(b):
+        src, _, tgt = line.partition("\t")
+        best = len(a)
+        for side in ((0, src), (1, tgt)):
+            candidates = positions.get(side, [])
+            k = bisect_left(candidates, ia)
+            if k < len(candidates):
+                best = min(best, candidates[k])
+
+        if best < len(a):
+            pairs.append((best, j))
+            ia = best + 1
+
+    return pairs
+
+
+def _similar_pairs(a: List[str], b: List[str],
+                   deadline: float) -> List[Tuple[int, int]]:
+    """Greedily pair lines which are similar enough (as `Differ` does, but
+    by words), until `deadline`"""
+    a_words = [_WORD_RE.findall(line) for line in a]
+    b_words = [_WORD_RE.findall(line) for line in b]
+    pairs = []
+    jlo = 0
+    matcher = SequenceMatcher(None, autojunk=False)
+
+    for i, words in enumerate(a_words):
+        if time.monotonic() >= deadline:
+            break
+        matcher.set_seq2(words)
+        best_ratio, best_j = FUZZY_PAIR_CUTOFF, None
+
+        for j in range(jlo, len(b)):
+            matcher.set_seq1(b_words[j])
+            if (matcher.real_quick_ratio() > best_ratio
+                    and matcher.quick_ratio() > best_ratio):
+                if max(len(words), len(b_words[j])) > FUZZY_RATIO_MAX_WORDS:
+                    ratio = matcher.quick_ratio()
+                else:
+                    ratio = matcher.ratio()
+                if ratio > best_ratio:
+                    best_ratio, best_j = ratio, j
+
+        if best_j is not None:
+            pairs.append((i, best_j))
+            jlo = best_j + 1
+
+    return pairs
+
+
+def _fuzzy_pairs(a: List[str], b: List[str],
+                 deadline: float) -> List[Tuple[int, int]]:
+    """Pair lines of a replaced block which are modifications of each other.
+
+    Lines with one side unchanged (most filters rewrite only one language)
+    are paired first; the lines in between are paired by similarity.
+    """
+    pairs = []
+    ia, jb = 0, 0
+    for i, j in _side_pairs(a, b) + [(len(a), len(b))]:
+        if i > ia and j > jb:
+            pairs.extend((ia + si, jb + sj) for si, sj
+                         in _similar_pairs(a[ia:i], b[jb:j], deadline))
+        if i < len(a):
+            pairs.append((i, j))
+        ia, jb = i + 1, j + 1
+
+    return pairs
+
+
+def _replace_lines(a: List[str], b: List[str],
+                   deadline: float) -> Iterable[str]:
+    # pairing cannot change the output of a single replaced line
+    if (len(a) * len(b) > FUZZY_PAIR_LIMIT or len(a) == len(b) == 1
+            or time.monotonic() >= deadline):
+        pairs = []
+    else:
+        pairs = _fuzzy_pairs(a, b, deadline)
+
+    ia, jb = 0, 0
+    for i, j in pairs + [(len(a), len(b))]:
+        for line in a[ia:i]:
+            yield "- " + line
+        for line in b[jb:j]:
+            yield "+ " + line
+
+        if i < len(a):
+            yield "- " + a[i]
+            yield "+ " + b[j]
+
+        ia, jb = i + 1, j + 1
+
+
+def patience_engine(a: List[str], b: List[str]) -> Iterable[str]:
+    """Line diff in `Differ` format, linear in the common case.
+
+    Lines are aligned by hashing (patience diff); the quadratic fuzzy
+    matching is only used inside small replaced blocks (within the
+    `FUZZY_PAIR_*` budgets).
+    """
+    deadline = time.monotonic() + FUZZY_PAIR_TIME_BUDGET
+
+    ia, jb = 0, 0
+    for i, j in _matching_lines(a, b) + [(len(a), len(b))]:
+        if i > ia and j > jb:
+            yield from _replace_lines(a[ia:i], b[jb:j], deadline)
+        else:
+            for line in a[ia:i]:
+                yield "- " + line
+            for line in b[jb:j]:
+                yield "+ " + line
+
+        if i < len(a):
+            yield "  " + a[i]
+
+        ia, jb = i + 1, j + 1
+
+
+def differ_engine(a: List[str], b: List[str]) -> Iterable[str]:
+    """Line diff using the Python Differ class (quadratic)"""
+    return Differ().compare(a, b)
+
+
+DIFF_ENGINES: Dict[str, DiffEngine] = {
+    "patience": patience_engine,
+    "differ": differ_engine,
+}
+DEFAULT_DIFF_ENGINE = "patience"
+
+
+def bitext_rows(src: List[str], tgt: List[str]) -> List[str]:
+    """Tab-separated rows, which is what the diff engines compare"""
+    assert len(src) == len(tgt)
+    return [f"{s}\t{t}" for s, t in zip(src, tgt)]
+
+
+def intraline_markup(old: str, new: str) -> Optional[Tuple[Markup, Markup]]:
+    """Markup of the changed tokens of a modified line.
+
+    Returns `None` if the line is over the `INTRALINE_TOKEN_BUDGET` or if the
+    two versions have too little in common.
+    """
+    prefix = len(commonprefix([old, new]))
+    max_suffix = min(len(old), len(new)) - prefix
+    suffix = len(commonprefix([old[:-max_suffix - 1:-1],
+                               new[:-max_suffix - 1:-1]]))
+
+    old_tokens = _TOKEN_RE.findall(old[prefix:len(old) - suffix])
+    new_tokens = _TOKEN_RE.findall(new[prefix:len(new) - suffix])
+
+    if len(old_tokens) * len(new_tokens) > INTRALINE_TOKEN_BUDGET:
+        return None
+
+    old_markup: Markup = []
+    new_markup: Markup = []
+    if prefix:
+        old_markup.append((DIFF_MINUS_WHOLE, old[:prefix]))
+        new_markup.append((DIFF_PLUS_WHOLE, new[:prefix]))
+
+    common = prefix + suffix
+    matcher = SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        old_chunk = "".join(old_tokens[i1:i2])
+        new_chunk = "".join(new_tokens[j1:j2])
+
+        if tag == "equal":
+            common += len(old_chunk)
+            old_markup.append((DIFF_MINUS_WHOLE, old_chunk))
+            new_markup.append((DIFF_PLUS_WHOLE, new_chunk))
+            continue
+
+        if old_chunk:
+            old_markup.append((DIFF_MINUS, old_chunk))
+        if new_chunk:
+            new_markup.append((DIFF_PLUS, new_chunk))
+
+    if suffix:
+        old_markup.append((DIFF_MINUS_WHOLE, old[len(old) - suffix:]))
+        new_markup.append((DIFF_PLUS_WHOLE, new[len(new) - suffix:]))
+
+    if common < INTRALINE_MIN_RATIO * max(len(old), len(new)):
+        return None
 
-    tabsep_rev1 = [f"{src}\t{tgt}" for src, tgt in zip(rev1_src, rev1_tgt)]
-    tabsep_rev2 = [f"{src}\t{tgt}" for src, tgt in zip(rev2_src, rev2_tgt)]
+    return (old_markup or [(DIFF_MINUS_WHOLE, "")],
+            new_markup or [(DIFF_PLUS_WHOLE, "")])
 
 
-    d = Differ()
-    difflines = d.compare(tabsep_rev1, tabsep_rev2)
+def _intraline_hunk(hunk: BitextDiff) -> BitextDiff:
+    (src_old, tgt_old), (src_new, tgt_new) = hunk
+    old_row, new_row = [], []
+
+    for (_, old), (_, new) in [(src_old, src_new), (tgt_old, tgt_new)]:
+        markup = intraline_markup(old, new)
+        if markup is None:
+            markup = (DIFF_MINUS_WHOLE, old), (DIFF_PLUS_WHOLE, new)
+        old_row.append(markup[0])
+        new_row.append(markup[1])
+
+    return [tuple(old_row), tuple(new_row)]
+
+
+def _difflines_markup(difflines: Iterable[str],
+                      intraline: bool = False) -> BitextDiff:
+    deadline = time.monotonic() + INTRALINE_TIME_BUDGET
 
     diff = []
     for partial_diff in _parse_difflines(DiffLine(d) for d in difflines):
+        # two-line hunks are a removed line followed by its replacement
+        if (intraline and len(partial_diff) == 2
+                and time.monotonic() < deadline):
+            partial_diff = _intraline_hunk(partial_diff)
+
         diff.extend(partial_diff)
 
     return diff
 
 
+def diff_bitexts(rev1_src: List[str], rev1_tgt: List[str],
+                 rev2_src: List[str], rev2_tgt: List[str],
+                 engine: str = DEFAULT_DIFF_ENGINE,
+                 intraline: bool = False) -> BitextDiff:
+    """Bitext diff, respecting the number of items in revisions.
+
+    Do not assume anything about the diff - most general diff for filters
+    which add, remove or change lines.
+
+    Try to guess which lines have been changed - this is delegated to one of
+    the `DIFF_ENGINES`. With `intraline`, only the changed parts of
+    modified lines are highlighted (within the `INTRALINE_*` budgets).
+    """
+    tabsep_rev1 = bitext_rows(rev1_src, rev1_tgt)
+    tabsep_rev2 = bitext_rows(rev2_src, rev2_tgt)
+
+    return _difflines_markup(
+        DIFF_ENGINES[engine](tabsep_rev1, tabsep_rev2), intraline)
+
+
+def _gap_pairs(a: List[str], b: List[str],
+               deadline: float) -> List[Tuple[int, int]]:
+    if len(a) * len(b) <= FUZZY_PAIR_LIMIT and time.monotonic() < deadline:
+        return _fuzzy_pairs(a, b, deadline)
+
+    if len(a) == len(b):
+        # every line rewritten in place
+        return list(zip(range(len(a)), range(len(b))))
+
+    return _side_pairs(a, b)
+
+
+def track_origins(prev_rows: List[str], prev_origins: List[Optional[int]],
+                  rows: List[str]) -> List[Optional[int]]:
+    """Recover the origin of each row of a filter step output.
+
+    Filters drop or rewrite rows but rarely reorder them. The rows are
+    therefore matched to the rows of the previous step in a single greedy
+    pass by hash. Unmatched rows in between two matches are paired with the
+    unmatched rows of the previous step as rewrites of them. Each row gets
+    the origin of the row it was matched or paired with, and `None` if it
+    seems to be new. Gaps are paired by similarity within the
+    `FUZZY_PAIR_*` budgets, same as in `patience_engine`.
+    """
+    assert len(prev_rows) == len(prev_origins)
+    deadline = time.monotonic() + FUZZY_PAIR_TIME_BUDGET
+
+    positions: Dict[str, List[int]] = {}
+    for i, row in enumerate(prev_rows):
+        positions.setdefault(row, []).append(i)
+
+    origins: List[Optional[int]] = [None] * len(rows)
+
+    def pair_gap(ilo, ihi, jlo, jhi):
+        if ilo == ihi or jlo == jhi:
+            return
+
+        for i, j in _gap_pairs(prev_rows[ilo:ihi], rows[jlo:jhi], deadline):
+            origins[jlo + j] = prev_origins[ilo + i]
+
+    ia, jgap = 0, 0
+    for j, row in enumerate(rows):
+        candidates = positions.get(row)
+        if not candidates:
+            continue
+
+        k = bisect_left(candidates, ia)
+        if k == len(candidates):
+            continue
+
+        i = candidates[k]
+        pair_gap(ia, i, jgap, j)
+        origins[j] = prev_origins[i]
+        ia, jgap = i + 1, j + 1
+
+    pair_gap(ia, len(prev_rows), jgap, len(rows))
+    return origins
+
+
+def compare_origins(a_origins: List[Optional[int]],
+                    b_origins: List[Optional[int]]) -> Tuple[int, int, int]:
+    """Number of rows kept only in `a`, only in `b`, and in both, given the
+    origins of the rows of two outputs of the same input.
+
+    Rows kept in both may have been changed differently. New rows (with no
+    origin) only count for their own output.
+    """
+    a_kept = {origin for origin in a_origins if origin is not None}
+    b_kept = {origin for origin in b_origins if origin is not None}
+
+    both = len(a_kept & b_kept)
+    only_a = len(a_kept) - both + a_origins.count(None)
+    only_b = len(b_kept) - both + b_origins.count(None)
+    return only_a, only_b, both
+
+
+def _merge_by_origin(a: List[str], a_origins: List[Optional[int]],
+                     b: List[str], b_origins: List[Optional[int]]
+                     ) -> Iterable[str]:
+    i, j = 0, 0
+    while i < len(a) or j < len(b):
+        if j < len(b) and b_origins[j] is None:
+            yield "+ " + b[j]
+            j += 1
+
+        elif i < len(a) and a_origins[i] is None:
+            yield "- " + a[i]
+            i += 1
+
+        elif j == len(b) or (i < len(a) and a_origins[i] < b_origins[j]):
+            yield "- " + a[i]
+            i += 1
+
+        elif i == len(a) or b_origins[j] < a_origins[i]:
+            yield "+ " + b[j]
+            j += 1
+
+        else:
+            if a[i] == b[j]:
+                yield "  " + a[i]
+            else:
+                yield "- " + a[i]
+                yield "+ " + b[j]
+            i += 1
+            j += 1
+
+
+def diff_bitexts_by_origin(
+        rev1_src: List[str], rev1_tgt: List[str],
+        rev1_origins: List[Optional[int]],
+        rev2_src: List[str], rev2_tgt: List[str],
+        rev2_origins: List[Optional[int]],
+        intraline: bool = False) -> BitextDiff:
+    """Bitext diff of two revisions with known row origins.
+
+    The origins (see `track_origins`) say which row of a common ancestor
+    revision each row comes from, so the diff is a linear merge: rows with
+    the same origin are kept or modified, the rest are removed or added.
+    """
+    assert len(rev1_src) == len(rev1_origins)
+    assert len(rev2_src) == len(rev2_origins)
+
+    tabsep_rev1 = bitext_rows(rev1_src, rev1_tgt)
+    tabsep_rev2 = bitext_rows(rev2_src, rev2_tgt)
+
+    return _difflines_markup(_merge_by_origin(
+        tabsep_rev1, rev1_origins, tabsep_rev2, rev2_origins), intraline)
+
+
 # Test code follows.
 
 def main():
@@ -233,7 +719,25 @@ delta
 fero""".splitlines()
 
 
-    rows = diff_bitexts(text1_src, text1_tgt, text2_src, text2_tgt)
+    for engine in DIFF_ENGINES:
+        print(f"Engine: {engine}")
+        rows = diff_bitexts(text1_src, text1_tgt, text2_src, text2_tgt, engine)
+        for (left, right) in rows:
+            print(left, "\t", right)
+
+    print("Intra-line:")
+    rows = diff_bitexts(text1_src, text1_tgt, text2_src, text2_tgt,
+                        intraline=True)
+    for (left, right) in rows:
+        print(left, "\t", right)
+
+    print("By origin:")
+    rev1 = bitext_rows(text1_src, text1_tgt)
+    rev2 = bitext_rows(text2_src, text2_tgt)
+    rev1_origins = list(range(len(rev1)))
+    rev2_origins = track_origins(rev1, rev1_origins, rev2)
+    rows = diff_bitexts_by_origin(text1_src, text1_tgt, rev1_origins,
+                                  text2_src, text2_tgt, rev2_origins)
     for (left, right) in rows:
         print(left, "\t", right)
 
@@ -0,0 +1,196 @@
+"""Lazily loaded catalogue of the filters in `FILTER_PATH`.
+
+OpusCleaner's `list_filters()` reads and validates every filter definition,
+which with a few hundred custom filters takes a while before the app can
+start. The catalogue instead keeps an index of the filter files under
+`CACHE_PATH`, with the modification time of each file and the name of the
+filter it defines. On startup, the files are only globbed and their
+modification times checked. A file is read again only if it changed, and
+parsed into a full filter definition only once the filter is used. A parsed
+definition is parsed again when its file changes afterwards, so that edits
+to a filter take effect without restarting.
+
+`install()` makes the catalogue OpusCleaner's filter registry, so that
+`get_global_filter()` and the validation of pipeline steps use it too.
+"""
+
+import hashlib
+import json
+import os
+from collections.abc import Mapping
+from glob import glob
+from typing import Dict, Iterator, List, Optional, Tuple
+from warnings import warn
+
+import opuscleaner.filters
+from opuscleaner.config import FILTER_PATH
+from opuscleaner.filters import Filter
+from pydantic import parse_obj_as
+
+from clianer.config import CACHE_PATH
+
+
+# Bump when the layout of the index file changes
+INDEX_VERSION = 1
+
+
+def _defaults(path: str) -> Dict[str, str]:
+    """Fields OpusCleaner fills in from the path of a filter definition"""
+    return {
+        "name": os.path.splitext(os.path.basename(path))[0],
+        "basedir": os.path.dirname(path),
+    }
+
+
+def _read_name(path: str) -> Optional[str]:
+    """Name of the filter defined in the file, without validating it"""
+    try:
+        with open(path) as fh:
+            definition = json.load(fh)
+    except (OSError, ValueError) as e:
+        warn(f"Could not parse {path}: {e}")
+        return None
+
+    if not isinstance(definition, dict):
+        warn(f"Could not parse {path}: not a filter definition")
+        return None
+
+    return str(definition.get("name", _defaults(path)["name"]))
+
+
+class FilterCatalogue(Mapping):
+    """Mapping of filter names to their definitions, parsed on first use"""
+
+    def __init__(self, paths: str = FILTER_PATH,
+                 index_path: Optional[str] = None) -> None:
+        if index_path is None:
+            digest = hashlib.sha1(paths.encode()).hexdigest()[:16]
+            index_path = os.path.join(CACHE_PATH, f"filters-{digest}.json")
+
+        self.paths = paths
+        self.index_path = index_path
+
+        # filter file -> (mtime, name of the filter or None if invalid)
+        self.files: Dict[str, Tuple[float, Optional[str]]] = {}
+        # filter name -> file, later files win like in OpusCleaner
+        self.names: Dict[str, str] = {}
+        self.filters: Dict[str, Filter] = {}
+
+    def _load_index(self) -> Dict[str, Tuple[float, Optional[str]]]:
+        try:
+            with open(self.index_path) as fh:
+                index = json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+        if index.get("version") != INDEX_VERSION \
+                or index.get("paths") != self.paths:
+            return {}
+        return {path: tuple(entry) for path, entry in index["files"].items()}
+
+    def _save_index(self) -> None:
+        index = {
+            "version": INDEX_VERSION,
+            "paths": self.paths,
+            "files": self.files,
+        }
+
+        # the index is only a cache, failing to write it is not an error
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(self.index_path + ".tmp", "w") as fh:
+                json.dump(index, fh)
+            os.replace(self.index_path + ".tmp", self.index_path)
+        except OSError:
+            pass
+
+    def refresh(self) -> None:
+        """Find the filter files, reading only the new and changed ones"""
+        cached = self.files or self._load_index()
+
+        files = {}
+        for pattern in self.paths.split(os.pathsep):
+            for path in glob(pattern, recursive=True):
+                try:
+                    mtime = os.stat(path).st_mtime
+                except OSError:
+                    continue
+
+                entry = cached.get(path)
+                if entry is None or entry[0] != mtime:
+                    entry = (mtime, _read_name(path))
+                files[path] = entry
+
+        changed = files != cached
+        self.files = files
+        self.names = {
+            name: path for path, (_, name) in files.items() if name is not None}
+        self.filters = {
+            name: spec for name, spec in self.filters.items()
+            if name in self.names}
+
+        if changed:
+            self._save_index()
+
+    def __getitem__(self, name: str) -> Filter:
+        path = self.names[name]
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            # removed since, keep using what was read
+            mtime = self.files[path][0]
+
+        spec = self.filters.get(name)
+        if spec is not None and mtime == self.files[path][0]:
+            return spec
+
+        try:
+            with open(path) as fh:
+                spec = parse_obj_as(Filter, {**_defaults(path), **json.load(fh)})
+        except Exception as e:
+            # same as a filter OpusCleaner would not list
+            warn(f"Could not parse {path}: {e}")
+            self.files[path] = (mtime, None)
+            del self.names[name]
+            self.filters.pop(name, None)
+            self._save_index()
+            raise KeyError(name) from e
+
+        if mtime != self.files[path][0]:
+            self.files[path] = (mtime, name)
+            self._save_index()
+        self.filters[name] = spec
+        return spec
+
+    def __contains__(self, name) -> bool:
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def sorted_names(self) -> List[str]:
+        return sorted(self.names)
+
+    def install(self) -> None:
+        """Make the catalogue the filter registry of OpusCleaner, in place of
+        `set_global_filters(list_filters(...))`"""
+        opuscleaner.filters._FILTERS = self
+
+
+_catalogue: Optional[FilterCatalogue] = None
+
+
+def get_filter_catalogue() -> FilterCatalogue:
+    """The filter catalogue shared by the whole app"""
+    global _catalogue
+    if _catalogue is None:
+        _catalogue = FilterCatalogue()
+        _catalogue.refresh()
+    return _catalogue
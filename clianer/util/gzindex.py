@@ -0,0 +1,379 @@
+"""Random access to the lines of (gzip compressed) dataset files.
+
+Getting to a line in the middle of a gzip file means decompressing everything
+before it. A `LineIndex` makes that a short decompression from a nearby point
+instead. It is built in a single pass over the file, and records
+
+- the uncompressed offset of every `LINE_SPACING`-th line, and
+- points where decompression can start. With `indexed_gzip` installed, these
+  are zran-style checkpoints (the state of the decompressor every
+  `SEEK_POINT_SPACING` bytes). Without it, they are the starts of the gzip
+  members only. That is enough for files compressed in blocks (bgzip,
+  `pigz -i`, concatenated files), but any other file has to be decompressed
+  from its start again.
+
+Uncompressed files are indexed too, seeking in them is free. Indexes are
+saved under `CACHE_PATH` and rebuilt when the file changes.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import zlib
+from array import array
+from bisect import bisect_right
+from typing import IO, Iterable, Iterator, List, Tuple
+from warnings import warn
+
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None
+
+from clianer.config import CACHE_PATH
+
+
+# Bump when the layout of the index files changes
+INDEX_VERSION = 1
+
+# Every this many lines, the offset of the line is kept in the index
+LINE_SPACING = 1000
+
+# Uncompressed bytes between two checkpoints of indexed_gzip
+SEEK_POINT_SPACING = 4 * 1024 * 1024
+
+# Bytes read from the file at once while indexing
+READ_SIZE = 1024 * 1024
+
+# Decompressed data is scanned for lines in pieces of this many bytes
+SCAN_SIZE = 64 * 1024
+
+# Lines between two wanted ones that are read through rather than seeked over
+MAX_SKIP_LINES = 2 * LINE_SPACING
+
+
+def _nth_newline(data: bytes, n: int, start: int = 0) -> int:
+    """Position of the `n`-th (counting from 1) newline in `data` after
+    `start`"""
+    lo, hi = start, len(data) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        count = data.count(b"\n", lo, mid + 1)
+        if count >= n:
+            hi = mid
+        else:
+            n -= count
+            lo = mid + 1
+    return lo
+
+
+class _LineScanner:
+    """Keeps the offsets of every `LINE_SPACING`-th line of the data fed to
+    it, in pieces."""
+
+    def __init__(self) -> None:
+        self.offsets = array("Q", [0])
+        self.newlines = 0
+        self.size = 0
+        self.ends_with_newline = True
+
+    def feed(self, data: bytes) -> None:
+        for start in range(0, len(data), SCAN_SIZE):
+            self._feed(data[start:start + SCAN_SIZE])
+
+    def _feed(self, data: bytes) -> None:
+        count = data.count(b"\n")
+        target = len(self.offsets) * LINE_SPACING
+        position = -1
+        seen = self.newlines
+        while self.newlines + count >= target:
+            position = _nth_newline(data, target - seen, position + 1)
+            self.offsets.append(self.size + position + 1)
+            seen = target
+            target += LINE_SPACING
+
+        self.newlines += count
+        self.size += len(data)
+        if data:
+            self.ends_with_newline = data.endswith(b"\n")
+
+    @property
+    def line_count(self) -> int:
+        return self.newlines + (0 if self.ends_with_newline else 1)
+
+
+def _is_gzip(path: str) -> bool:
+    with open(path, "rb") as fh:
+        return fh.read(2) == b"\x1f\x8b"
+
+
+def _scan_members(fh: IO[bytes], scanner: _LineScanner) -> List[List[int]]:
+    """Decompress a gzip file member by member, feeding the data to
+    `scanner`, and return the compressed and uncompressed offset of the start
+    of each member."""
+    members = []
+    decompressor = None
+    offset = 0 # compressed offset of `data`
+    data = b""
+
+    while True:
+        if not data:
+            data = fh.read(READ_SIZE)
+            if not data:
+                break
+
+        if decompressor is None:
+            # gzip allows zero padding after the last member
+            padding = len(data) - len(data.lstrip(b"\0"))
+            offset, data = offset + padding, data[padding:]
+            if not data:
+                continue
+            members.append([offset, scanner.size])
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+        scanner.feed(decompressor.decompress(data))
+        if decompressor.eof:
+            offset += len(data) - len(decompressor.unused_data)
+            data = decompressor.unused_data
+            decompressor = None
+        else:
+            offset += len(data)
+            data = b""
+
+    if decompressor is not None:
+        raise EOFError(
+            "Compressed file ended before the end-of-stream marker was reached")
+
+    return members
+
+
+class LineIndex:
+    """Index of the lines of a file, see the module docstring.
+
+    Use `get_index()` to get the index of a file loaded or built.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = os.path.abspath(path)
+        stat = os.stat(self.path)
+        self.size, self.mtime = stat.st_size, stat.st_mtime
+
+        digest = hashlib.sha1(self.path.encode()).hexdigest()[:16]
+        self.index_path = os.path.join(CACHE_PATH, "gzindex", digest)
+
+        self.compressed = _is_gzip(self.path)
+        self.line_count = 0
+        self.offsets = array("Q")
+        # compressed and uncompressed offsets of the gzip members
+        self.members: List[List[int]] = []
+        # whether there is an indexed_gzip index next to this one
+        self.seek_points = False
+
+    def _header(self) -> dict:
+        return {
+            "version": INDEX_VERSION,
+            "path": self.path,
+            "size": self.size,
+            "mtime": self.mtime,
+            "line_spacing": LINE_SPACING,
+        }
+
+    def load(self) -> bool:
+        """Load the saved index, if there is one for the current file"""
+        try:
+            with open(self.index_path + ".json") as fh:
+                saved = json.load(fh)
+            if {key: saved.get(key) for key in self._header()} \
+                    != self._header():
+                return False
+            if saved["seek_points"] and indexed_gzip is None:
+                # not usable without indexed_gzip, build a new one
+                return False
+
+            offsets = array("Q")
+            with open(self.index_path + ".lines", "rb") as fh:
+                offsets.frombytes(fh.read())
+        except (OSError, ValueError, KeyError):
+            return False
+
+        self.line_count = saved["line_count"]
+        self.members = saved["members"]
+        self.seek_points = saved["seek_points"]
+        self.offsets = offsets
+        return True
+
+    def build(self) -> None:
+        """Index the file in one pass and save the index"""
+        scanner = _LineScanner()
+
+        if not self.compressed:
+            with open(self.path, "rb") as fh:
+                for data in iter(lambda: fh.read(READ_SIZE), b""):
+                    scanner.feed(data)
+        elif indexed_gzip is not None:
+            with indexed_gzip.IndexedGzipFile(
+                    self.path, spacing=SEEK_POINT_SPACING) as fh:
+                for data in iter(lambda: fh.read(READ_SIZE), b""):
+                    scanner.feed(data)
+                os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+                fh.export_index(self.index_path + ".zran")
+            self.seek_points = True
+        else:
+            with open(self.path, "rb") as fh:
+                self.members = _scan_members(fh, scanner)
+            if len(self.members) == 1 and scanner.size > SEEK_POINT_SPACING:
+                warn(f"{self.path} is a single gzip stream, reading lines "
+                     "from its middle means decompressing it from the "
+                     "start. Install indexed_gzip to avoid that.")
+
+        self.line_count = scanner.line_count
+        self.offsets = scanner.offsets
+        self.save()
+
+    def save(self) -> None:
+        saved = {
+            **self._header(),
+            "line_count": self.line_count,
+            "members": self.members,
+            "seek_points": self.seek_points,
+        }
+
+        # the index is only a cache, failing to write it is not an error
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(self.index_path + ".lines", "wb") as fh:
+                self.offsets.tofile(fh)
+            # written last, the index is only used once this file exists
+            with open(self.index_path + ".json.tmp", "w") as fh:
+                json.dump(saved, fh)
+            os.replace(self.index_path + ".json.tmp",
+                       self.index_path + ".json")
+        except OSError:
+            pass
+
+    def is_current(self) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime) == (self.size, self.mtime)
+
+    def _member(self, offset: int) -> List[int]:
+        """The gzip member containing the uncompressed `offset`"""
+        k = bisect_right([start for _, start in self.members], offset) - 1
+        return self.members[max(k, 0)]
+
+    def _seekable(self) -> bool:
+        """Whether an open file seeks to any offset from nearby"""
+        return not self.compressed or self.seek_points
+
+    def _restart_offset(self, offset: int) -> int:
+        """Where decompression starts when opening the file at `offset`"""
+        if self._seekable():
+            return offset
+        return self._member(offset)[1]
+
+    def _open_at(self, offset: int) -> Tuple[IO[bytes], int]:
+        if not self.compressed:
+            fh = open(self.path, "rb")
+            fh.seek(offset)
+            return fh, 0
+
+        if self.seek_points:
+            fh = indexed_gzip.IndexedGzipFile(
+                self.path, spacing=SEEK_POINT_SPACING,
+                index_file=self.index_path + ".zran")
+            fh.seek(offset)
+            return fh, 0
+
+        # start at the last member before the offset and read up to it
+        compressed_start, start = self._member(offset)
+        raw = open(self.path, "rb")
+        raw.seek(compressed_start)
+        fh = gzip.GzipFile(fileobj=raw)
+        fh.seek(offset - start)
+        # closing the gzip file does not close a file object it was given
+        fh.myfileobj = raw
+        return fh, start
+
+    def open_at(self, offset: int) -> IO[bytes]:
+        """Binary file object of the uncompressed data, positioned at
+        `offset` (its `tell()` is not the offset in the file)"""
+        return self._open_at(offset)[0]
+
+    def line_offset(self, line: int) -> Tuple[int, int]:
+        """Offset of the closest indexed line not after `line`, and the
+        number of that line"""
+        k = min(line // LINE_SPACING, len(self.offsets) - 1)
+        return self.offsets[k], k * LINE_SPACING
+
+    def read_lines(self, line_numbers: Iterable[int]) -> Iterator[bytes]:
+        """The lines with the given (ascending) numbers, with newlines"""
+        fh, base = None, 0
+        current = 0 # number of the line `fh` is at
+        try:
+            for line in line_numbers:
+                if fh is None or line < current \
+                        or line - current > MAX_SKIP_LINES:
+                    offset, number = self.line_offset(line)
+                    if fh is not None and self._seekable():
+                        # seeking does not need to decompress from a restart
+                        # point that is far away, nor to load the index again
+                        fh.seek(offset - base)
+                    elif fh is not None and line > current \
+                            and self._restart_offset(offset) \
+                                <= base + fh.tell():
+                        # reading on is shorter than starting over
+                        fh.seek(offset - base)
+                    else:
+                        if fh is not None:
+                            fh.close()
+                        fh, base = self._open_at(offset)
+                    current = number
+
+                while current < line:
+                    fh.readline()
+                    current += 1
+
+                yield fh.readline()
+                current += 1
+        finally:
+            if fh is not None:
+                fh.close()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(path: str) -> LineIndex:
+    """Index of the file, loaded or built (which reads the whole file)"""
+    path = os.path.abspath(path)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is not None and index.is_current():
+            return index
+
+        index = LineIndex(path)
+        if not index.load():
+            index.build()
+        _indexes[path] = index
+        return index
+
+
+def random_line_numbers(line_count: int, seed: int = 0) -> Iterator[int]:
+    """Distinct line numbers in random order, until all are used.
+
+    The first `k` of them are a uniform sample of `k` lines for any `k`, so
+    a bigger sample drawn with the same seed contains the smaller one.
+    """
+    rand = random.Random(seed)
+    seen = set()
+    while len(seen) < line_count:
+        line = rand.randrange(line_count)
+        if line not in seen:
+            seen.add(line)
+            yield line
@@ -0,0 +1,650 @@
+"""Incremental execution of filter pipelines over a dataset sample.
+
+Outputs of the individual filter steps are cached under a key derived from the
+dataset name, the identity of the sample and a hash of the filter prefix that
+produced them. Changing a step therefore only reruns the steps from that step
+onward, and reordering or removing steps reuses every untouched prefix.
+
+Each step is measured while it runs (see `StepStats`); cached outputs keep the
+statistics of the run that produced them.
+
+The outputs are kept parsed, in a `RowStore` per dataset shared by all of
+them (see `clianer.util.rows`), and only made into bytes again when they are
+the input of the next step.
+
+Besides OpusCleaner's sample, a pipeline can run on the first lines of the
+dataset (see `HeadSample`) or on random lines of all of it (`RandomSample`),
+of any size. That sample is read and filtered in
+chunks of growing size, each cached on its own, so results for the first few
+hundred rows are shown right away and growing the sample only filters the rows
+which were not filtered yet. Like `opuscleaner.clean --parallel`, this assumes
+that filters process lines independently of each other.
+
+Several variants of a pipeline can run side by side on the same sample (see
+`run_variants`). A step which is already running for one of them is not
+started again for another, so the prefix the variants share runs once.
+The same goes for a sweep of the parameters of a step (see `run_sweep`),
+which runs the step with each set of parameters on the (cached) output of
+the steps before it, and keeps only the statistics of each.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack
+from itertools import islice
+from typing import (
+    AsyncIterator, Awaitable, Callable, Dict, Iterator, List, NamedTuple,
+    Optional, Tuple)
+
+from opuscleaner.config import DATA_PATH
+from opuscleaner.datasets import list_datasets
+from opuscleaner.filters import (
+    FilterStep, get_global_filter, filter_format_command)
+
+from clianer.util.gzindex import get_index, random_line_numbers
+from clianer.util.rows import RowStore, StepOutput, StepRows
+
+
+CacheKey = Tuple[str, bytes, bytes]
+
+
+class FilterOutput(NamedTuple):
+    """Same as `opuscleaner.server.FilterOutput`, which is not imported on
+    startup as `opuscleaner.server` loads OpusCleaner's whole web app."""
+    langs: List[str] # order of columns
+    returncode: int
+    stdout: bytes
+    stderr: bytes
+
+
+# Rows in the first chunk of a head sample, every next chunk is twice as big
+HEAD_CHUNK_SIZE = 200
+
+# The rows store of a dataset is rebuilt from the cached outputs once it holds
+# more than twice the rows they refer to, and at least this many rows
+MIN_COMPACT_ROWS = 10000
+
+
+class StepStats(NamedTuple):
+    """Resources used by a filter step and what it did to the line count."""
+    wall_time: float # seconds
+    cpu_time: float # user and system seconds of the filter processes
+    input_lines: int
+    output_lines: int
+
+    @property
+    def drop_rate(self) -> float:
+        """Fraction of the input lines the step removed"""
+        if self.input_lines == 0:
+            return 0.0
+        return 1 - self.output_lines / self.input_lines
+
+    def __add__(self, other: "StepStats") -> "StepStats":
+        """Statistics of running the step on both inputs"""
+        return StepStats(*(a + b for a, b in zip(self, other)))
+
+
+CacheEntry = Tuple[StepOutput, StepStats]
+StepResult = Tuple[StepOutput, Optional[StepStats]]
+
+
+def sample_hash(sample: FilterOutput) -> bytes:
+    """Identity of a sample, used so that a resampled dataset is not served
+    outputs computed from the old sample."""
+    impl = hashlib.sha256("\t".join(sample.langs).encode())
+    impl.update(sample.stdout)
+    return impl.digest()
+
+
+def step_hash(step: FilterStep, seed: bytes = bytes()) -> bytes:
+    """Hash of a filter step chained onto the hash of the preceding prefix.
+
+    The definition of the filter is part of it, so that a step is run again
+    once its filter was changed.
+    """
+    impl = hashlib.sha256(seed)
+    impl.update(json.dumps(
+        [step.filter, step.language, step.parameters], sort_keys=True).encode())
+    impl.update(get_global_filter(step.filter).json(sort_keys=True).encode())
+    return impl.digest()
+
+
+class StepCache:
+    """LRU cache of filter step outputs.
+
+    Only successful outputs are stored, so a failing step is always rerun.
+    Steps which are still running are kept too (see `run`), with the number
+    of pipelines waiting for them. The outputs are parsed into the rows
+    store of their dataset (see `parse`).
+    """
+
+    def __init__(self, max_entries: int = 256) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self._running: Dict[CacheKey, List] = {}
+        self._stores: Dict[str, RowStore] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: CacheKey) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: CacheKey, entry: CacheEntry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._compact(key[0])
+
+    def parse(self, dataset: str, output: FilterOutput) -> StepOutput:
+        """`output` with its rows in the rows store of the dataset"""
+        store = self._stores.get(dataset)
+        if store is None or store.langs != output.langs:
+            store = self._stores[dataset] = RowStore(output.langs)
+        return store.parse(output)
+
+    def _compact(self, dataset: str) -> None:
+        """Drop the rows no cached output of the dataset refers to anymore.
+
+        Outputs which are not cached keep the old store as long as they are
+        used.
+        """
+        store = self._stores.get(dataset)
+        keys = [key for key in self._entries if key[0] == dataset]
+        used = sum(len(self._entries[key][0].stdout) for key in keys)
+        if store is None or len(store) <= max(MIN_COMPACT_ROWS, 2 * used):
+            return
+
+        store = self._stores[dataset] = RowStore(store.langs)
+        for key in keys:
+            output, stats = self._entries[key]
+            rows = StepRows(store, store.add_lines(output.stdout.lines()),
+                            output.stdout.newline)
+            self._entries[key] = output._replace(stdout=rows), stats
+
+    async def _parsed(self, dataset: str,
+                      run_step: Callable[[], Awaitable[
+                          Tuple[FilterOutput, StepStats]]]) -> CacheEntry:
+        output, stats = await run_step()
+        return self.parse(dataset, output), stats
+
+    async def run(self, key: CacheKey,
+                  run_step: Callable[[], Awaitable[
+                      Tuple[FilterOutput, StepStats]]]) -> CacheEntry:
+        """Output of a step, from the cache, or from `run_step()` which is
+        only called if the step is not running already.
+
+        The step is cancelled once no pipeline waits for it anymore.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+
+        running = self._running.get(key)
+        if running is None:
+            task = asyncio.ensure_future(self._parsed(key[0], run_step))
+            running = self._running[key] = [task, 0]
+            task.add_done_callback(lambda task: self._finished(key, task))
+
+        task = running[0]
+        running[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            running[1] -= 1
+            if running[1] == 0 and not task.done():
+                # a new run of the step must not wait for this one
+                task.cancel()
+                del self._running[key]
+
+    def _finished(self, key: CacheKey, task: asyncio.Future) -> None:
+        if self._running.get(key, [None])[0] is task:
+            del self._running[key]
+
+        if task.cancelled() or task.exception() is not None:
+            return
+        if task.result()[0].returncode == 0:
+            self.put(key, task.result())
+
+    def invalidate(self, dataset: Optional[str] = None) -> None:
+        if dataset is None:
+            self._entries.clear()
+            self._stores.clear()
+            return
+
+        for key in [key for key in self._entries if key[0] == dataset]:
+            del self._entries[key]
+        self._stores.pop(dataset, None)
+
+
+async def load_sample(dataset: str) -> FilterOutput:
+    """Raw sample of the dataset as provided by OpusCleaner."""
+    from opuscleaner.server import get_sample
+
+    # Exhaust the generator so OpusCleaner can finalize its own bookkeeping.
+    outputs = [output async for output in get_sample(dataset, [])]
+    return outputs[0]
+
+
+def _mtime(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _format_row(columns: Tuple[bytes, ...]) -> bytes:
+    return b"\t".join(column.rstrip(b"\r\n") for column in columns) + b"\n"
+
+
+class HeadSample:
+    """The first lines of a dataset, read as far as needed.
+
+    The rows are formatted the same as in OpusCleaner's sample, i.e. one
+    tab-separated column per language.
+    """
+
+    def __init__(self, dataset: str) -> None:
+        self.dataset = dataset
+        columns = list_datasets(DATA_PATH)[dataset]
+        self.langs = [lang for lang, _ in columns]
+        self.paths = [str(path) for _, path in columns]
+        self.mtimes = [_mtime(path) for path in self.paths]
+
+        self.rows: List[bytes] = []
+        self.exhausted = False
+        self._files = ExitStack()
+        self._reader: Optional[Iterator[Tuple[bytes, ...]]] = None
+        # reads run in worker threads, a cancelled one may still be running
+        self._lock = threading.Lock()
+
+    def is_current(self) -> bool:
+        """Whether none of the files changed since the sample was created"""
+        return [_mtime(path) for path in self.paths] == self.mtimes
+
+    def close(self) -> None:
+        with self._lock:
+            self._files.close()
+            self._reader = None
+
+    def _read(self, count: int) -> None:
+        with self._lock:
+            if self._reader is None and not self.exhausted:
+                files = [
+                    self._files.enter_context(
+                        gzip.open(path) if path.endswith(".gz")
+                        else open(path, "rb"))
+                    for path in self.paths]
+                self._reader = zip(*files)
+
+            while len(self.rows) < count and not self.exhausted:
+                line = next(self._reader, None)
+                if line is None:
+                    self.exhausted = True
+                    self._files.close()
+                    break
+                self.rows.append(_format_row(line))
+
+    async def chunk(self, start: int, end: int) -> FilterOutput:
+        """Rows `start` to `end` of the dataset (fewer at its end)"""
+        if len(self.rows) < end and not self.exhausted:
+            await asyncio.to_thread(self._read, end)
+        return FilterOutput(
+            self.langs, 0, b"".join(self.rows[start:end]), bytes())
+
+
+class RandomSample(HeadSample):
+    """Lines drawn at random from the whole dataset, without replacement.
+
+    The same line numbers are read from the file of each language, using the
+    indexes of the files (see `clianer.util.gzindex`), which are built by
+    reading the files whole the first time. The rows of a chunk are in the
+    order of the dataset.
+    """
+
+    def __init__(self, dataset: str, seed: int = 0) -> None:
+        super().__init__(dataset)
+        self.seed = seed
+        self._indexes = None
+        self._line_numbers: Optional[Iterator[int]] = None
+
+    def _read(self, count: int) -> None:
+        with self._lock:
+            if self._line_numbers is None:
+                self._indexes = [get_index(path) for path in self.paths]
+                self._line_numbers = random_line_numbers(
+                    min(index.line_count for index in self._indexes),
+                    self.seed)
+
+            numbers = sorted(
+                islice(self._line_numbers, count - len(self.rows)))
+            if len(self.rows) + len(numbers) < count:
+                self.exhausted = True
+
+            columns = [index.read_lines(numbers) for index in self._indexes]
+            self.rows.extend(_format_row(line) for line in zip(*columns))
+
+
+class SweepResult(NamedTuple):
+    """What a step of a parameter sweep did to the rows so far"""
+    stats: Optional[StepStats] # None if it failed
+    error: Optional[str]
+
+
+def head_chunks(size: int) -> Iterator[Tuple[int, int]]:
+    """Row ranges of the chunks a head sample of `size` rows is read in.
+
+    The ranges do not depend on `size` (but the last one is cut off), so
+    their outputs can be reused by a bigger sample.
+    """
+    start, chunk_size = 0, HEAD_CHUNK_SIZE
+    while start < size:
+        yield start, min(start + chunk_size, size)
+        start += chunk_size
+        chunk_size *= 2
+
+
+async def sample_chunks(sample: HeadSample,
+                        size: int) -> AsyncIterator[FilterOutput]:
+    """The first `size` rows of the sample in chunks (see `head_chunks`),
+    fewer if the dataset ends before"""
+    for start, end in head_chunks(size):
+        chunk = await sample.chunk(start, end)
+        if start > 0 and not chunk.stdout:
+            break
+        yield chunk
+
+        if sample.exhausted and len(sample.rows) <= end:
+            break
+
+
+def _filter_env():
+    # Make sure the binaries installed alongside OpusCleaner (e.g. col) can be
+    # found even if the virtualenv is not activated, same as OpusCleaner does.
+    pyenv_bin_path = os.path.dirname(sys.executable)
+    os_env_bin_paths = os.environ.get("PATH", "").split(os.pathsep)
+    if pyenv_bin_path in os_env_bin_paths:
+        return None
+
+    return {**os.environ,
+            "PATH": os.pathsep.join([pyenv_bin_path] + os_env_bin_paths)}
+
+
+def _line_count(data: bytes) -> int:
+    return data.count(b"\n") + (1 if data and not data.endswith(b"\n") else 0)
+
+
+# The filter command runs in a subshell, after which the shell writes the CPU
+# time of its children (the processes of the filter) with `times` to the end
+# of stderr, after a marker line. Unlike the resource usage of the children of
+# this process, that does not count the filter steps running at the same time.
+_TIMES_MARKER = "--- clianer filter times ---"
+_TIMED_COMMAND = ("(\n{command}\n)\nstatus=$?\n"
+                  f"printf '\\n{_TIMES_MARKER}\\n' >&2\n"
+                  "times >&2\nexit $status\n")
+
+# Minutes and seconds in the output of `times`: user and system time of the
+# shell on the first line, of its children on the second
+_TIMES_RE = re.compile(rb"(\d+)m([\d.]+)s")
+
+
+def _split_times(stderr: bytes) -> Tuple[bytes, float]:
+    """The stderr of the filter, and the CPU time of its processes"""
+    stderr, marker, times = stderr.rpartition(
+        b"\n" + _TIMES_MARKER.encode() + b"\n")
+    if not marker:
+        # not written if the shell was killed
+        return times, 0.0
+    seconds = [int(minutes) * 60 + float(seconds)
+               for minutes, seconds in _TIMES_RE.findall(times)]
+    return stderr, sum(seconds[2:4])
+
+
+async def _run_filter_step(step: FilterStep, langs: List[str],
+                           input: bytes) -> Tuple[FilterOutput, float]:
+    filter_definition = get_global_filter(step.filter)
+    command = filter_format_command(filter_definition, step, langs)
+    command = _TIMED_COMMAND.format(command=command)
+
+    process = await asyncio.create_subprocess_exec(
+        "sh", "-c", command,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=filter_definition.basedir,
+        env=_filter_env(),
+        start_new_session=True)
+
+    try:
+        stdout, stderr = await process.communicate(input=input)
+    except asyncio.CancelledError:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await process.wait()
+        raise
+
+    stderr, cpu_time = _split_times(stderr)
+    return FilterOutput(langs, process.returncode, stdout, stderr), cpu_time
+
+
+async def exec_filter_step(step: FilterStep, langs: List[str],
+                           input: bytes) -> FilterOutput:
+    """Run a single filter step on the given input.
+
+    The filter runs in its own process group. If the calling task is
+    cancelled, the whole group is killed so that no stale filter keeps
+    running in the background.
+    """
+    output, _ = await _run_filter_step(step, langs, input)
+    return output
+
+
+async def measure_filter_step(step: FilterStep, langs: List[str],
+                              input: bytes) -> Tuple[FilterOutput, StepStats]:
+    """Run a single filter step and measure it.
+
+    CPU time is that of the processes of this step only, as reported by the
+    shell running it, so steps running at the same time are not mixed up.
+    """
+    start_time = time.monotonic()
+    output, cpu_time = await _run_filter_step(step, langs, input)
+    stats = StepStats(
+        wall_time=time.monotonic() - start_time,
+        cpu_time=cpu_time,
+        input_lines=_line_count(input),
+        output_lines=_line_count(output.stdout))
+    return output, stats
+
+
+async def run_steps(dataset: str, sample: FilterOutput,
+                    filters: List[FilterStep], cache: StepCache
+                    ) -> AsyncIterator[CacheEntry]:
+    """Yield the output of each filter step on `sample` with its statistics.
+
+    Like OpusCleaner's `get_sample`, iteration stops after the first step
+    which exits with a non-zero status.
+    """
+    sample_id = sample_hash(sample)
+    prefix = bytes()
+    previous: Optional[StepOutput] = None
+
+    for step in filters:
+        prefix = step_hash(step, prefix)
+        key = (dataset, sample_id, prefix)
+
+        # the input is only put together if the step does not come from the
+        # cache
+        output, stats = await cache.run(
+            key, lambda: measure_filter_step(
+                step, sample.langs,
+                sample.stdout if previous is None
+                else previous.stdout.to_bytes()))
+        yield output, stats
+
+        if output.returncode != 0:
+            break
+
+        previous = output
+
+
+async def run_pipeline(dataset: str, filters: List[FilterStep],
+                       cache: StepCache) -> AsyncIterator[StepResult]:
+    """Yield OpusCleaner's sample of the dataset followed by the output of
+    each filter step, together with its statistics (`None` for the sample).
+    """
+    sample = await load_sample(dataset)
+    yield cache.parse(dataset, sample), None
+
+    async for entry in run_steps(dataset, sample, filters, cache):
+        yield entry
+
+
+async def _run_variants_on(dataset: str, sample: FilterOutput,
+                           variants: List[List[FilterStep]], cache: StepCache
+                           ) -> List[List[StepResult]]:
+    parsed = cache.parse(dataset, sample)
+
+    async def run(filters):
+        results: List[StepResult] = [(parsed, None)]
+        async for entry in run_steps(dataset, sample, filters, cache):
+            results.append(entry)
+        return results
+
+    return list(await asyncio.gather(*map(run, variants)))
+
+
+async def run_variants(dataset: str, variants: List[List[FilterStep]],
+                       cache: StepCache) -> List[List[StepResult]]:
+    """Run variants of a pipeline concurrently on OpusCleaner's sample of the
+    dataset, which is loaded once. Returns the results of each variant in
+    the same form as `run_pipeline` yields them."""
+    sample = await load_sample(dataset)
+    return await _run_variants_on(dataset, sample, variants, cache)
+
+
+def _concat_results(results: List[StepResult],
+                    more: List[StepResult]) -> List[StepResult]:
+    """Results of a pipeline on two samples concatenated, up to the first
+    step which failed on either of them"""
+    concatenated = []
+    for (output, stats), (more_output, more_stats) in zip(results, more):
+        concatenated.append((
+            StepOutput(output.returncode or more_output.returncode,
+                       output.stdout + more_output.stdout,
+                       output.stderr + more_output.stderr),
+            stats + more_stats if stats is not None else None))
+    return concatenated
+
+
+async def run_variants_progressive(sample: HeadSample,
+                                   variants: List[List[FilterStep]],
+                                   cache: StepCache, size: int
+                                   ) -> AsyncIterator[List[List[StepResult]]]:
+    """Run variants of a pipeline on the first `size` rows of a dataset,
+    chunk by chunk (see `head_chunks`), concurrently on each chunk.
+
+    After each chunk, yields the results of each variant so far in the same
+    form as `run_pipeline` does, i.e. the sample followed by the outputs of
+    the steps with their statistics. Stops after the chunk on which a step
+    of any variant failed.
+    """
+    results: Optional[List[List[StepResult]]] = None
+
+    async for chunk in sample_chunks(sample, size):
+        chunk_results = await _run_variants_on(
+            sample.dataset, chunk, variants, cache)
+
+        if results is None:
+            results = chunk_results
+        else:
+            results = [_concat_results(variant_results, more)
+                       for variant_results, more
+                       in zip(results, chunk_results)]
+        yield results
+
+        if any(variant_results[-1][0].returncode != 0
+               for variant_results in results):
+            break
+
+
+async def run_pipeline_progressive(sample: HeadSample,
+                                   filters: List[FilterStep],
+                                   cache: StepCache, size: int
+                                   ) -> AsyncIterator[List[StepResult]]:
+    """Same as `run_variants_progressive` with a single variant"""
+    async for results in run_variants_progressive(
+            sample, [filters], cache, size):
+        yield results[0]
+
+
+async def _opuscleaner_sample(dataset: str) -> AsyncIterator[FilterOutput]:
+    yield await load_sample(dataset)
+
+
+async def run_sweep(dataset: str, sample: Optional[HeadSample],
+                    size: Optional[int], filters: List[FilterStep],
+                    steps: List[FilterStep], cache: StepCache
+                    ) -> AsyncIterator[List[SweepResult]]:
+    """Run each of `steps` on the output of the pipeline `filters`,
+    concurrently.
+
+    The rows are OpusCleaner's sample of the dataset if `sample` is None,
+    else the first `size` rows of `sample`, chunk by chunk, same as for
+    `run_variants_progressive`. The output of the pipeline comes from the
+    cache if it ran already. Only the statistics of the steps are kept, their
+    outputs would push the pipeline out of the cache. After each chunk,
+    yields the results of the steps so far.
+    """
+    if sample is None:
+        chunks = _opuscleaner_sample(dataset)
+    else:
+        chunks = sample_chunks(sample, size)
+
+    totals: List[Optional[StepStats]] = [None] * len(steps)
+    errors: List[Optional[str]] = [None] * len(steps)
+
+    async for chunk in chunks:
+        previous = None
+        async for previous, _ in run_steps(dataset, chunk, filters, cache):
+            if previous.returncode != 0:
+                raise RuntimeError(previous.stderr)
+        input = (chunk.stdout if previous is None
+                 else previous.stdout.to_bytes())
+
+        async def measure(step):
+            output, stats = await measure_filter_step(
+                step, chunk.langs, input)
+            if output.returncode != 0:
+                return None, output.stderr.decode(errors="replace")
+            return stats, None
+
+        results = await asyncio.gather(*(measure(step) for step in steps))
+
+        for i, (stats, error) in enumerate(results):
+            if errors[i] is not None:
+                continue
+            if error is not None:
+                totals[i] = None
+                errors[i] = error
+            elif totals[i] is None:
+                totals[i] = stats
+            else:
+                totals[i] += stats
+
+        yield [SweepResult(stats, error)
+               for stats, error in zip(totals, errors)]
@@ -0,0 +1,155 @@
+"""Compact storage of the outputs of all steps of a pipeline.
+
+Most filter steps keep most of their input rows as they are, so parsing the
+output of every step on its own (as OpusCleaner's `ParsedFilterOutput` does)
+holds many copies of the same rows. A `RowStore` keeps each distinct row once,
+and the output of a step refers to its rows by their ids in the store
+(`StepRows`). A step that drops rows costs four bytes per row it keeps, and a
+step that rewrites rows only adds the rewritten ones to the store.
+
+Rows are only kept decoded. They are found by the hash of their line, and
+told apart from another row with the same hash by encoding it again; the few
+rows that do not encode back to their line (a carriage return, invalid
+UTF-8) are kept as lines too. The `StepCache` keeps only the `StepOutput` of
+each step, whose bytes are put together again (`StepRows.to_bytes()`) when
+they are the input of the next step.
+
+Rows are made into dicts from language to text, same as in
+`ParsedFilterOutput`, only when they are read.
+"""
+
+from array import array
+from itertools import zip_longest
+from typing import (
+    TYPE_CHECKING, Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple)
+
+if TYPE_CHECKING:
+    from clianer.util.pipeline import FilterOutput
+
+
+def _decode_fields(line: bytes) -> Tuple[str, ...]:
+    fields = []
+    for colno, field in enumerate(line.rstrip(b"\r").split(b"\t"), start=1):
+        try:
+            fields.append(field.decode())
+        except UnicodeDecodeError as e:
+            fields.append(f"[Error: Cannot decode column {colno}: {e!s}]")
+    return tuple(fields)
+
+
+def _encode(row: Tuple[str, ...]) -> bytes:
+    return "\t".join(row).encode()
+
+
+class RowStore:
+    """Distinct rows of the outputs of a pipeline, by id"""
+
+    def __init__(self, langs: List[str]) -> None:
+        self.langs = langs
+        # hash of the line -> id, for rows which encode back to their line
+        self.ids: Dict[int, int] = {}
+        # line -> id and id -> line, for all other rows
+        self.lines: Dict[bytes, int] = {}
+        self.raw_lines: Dict[int, bytes] = {}
+        # fields of each row, in the order of `langs`
+        self.rows: List[Tuple[str, ...]] = []
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def add(self, data: bytes) -> "StepRows":
+        """Rows of tab-separated `data`, adding the new ones"""
+        if not data:
+            return StepRows(self, array("I"))
+        if data.endswith(b"\n"):
+            return StepRows(self, self.add_lines(data[:-1].split(b"\n")))
+        return StepRows(self, self.add_lines(data.split(b"\n")), False)
+
+    def add_lines(self, lines: Iterable[bytes]) -> array:
+        """Ids of the rows of `lines`, adding the new ones"""
+        ids = array("I")
+        for line in lines:
+            key = hash(line)
+            row_id = self.ids.get(key)
+            if row_id is None or _encode(self.rows[row_id]) != line:
+                row_id = self.lines.get(line)
+            if row_id is None:
+                row_id = self._append(key, line)
+            ids.append(row_id)
+        return ids
+
+    def _append(self, key: int, line: bytes) -> int:
+        row_id = len(self.rows)
+        row = _decode_fields(line)
+        self.rows.append(row)
+        if key not in self.ids and _encode(row) == line:
+            self.ids[key] = row_id
+        else:
+            self.lines[line] = row_id
+            self.raw_lines[row_id] = line
+        return row_id
+
+    def row(self, row_id: int) -> Dict[str, str]:
+        return dict(zip_longest(self.langs, self.rows[row_id], fillvalue=""))
+
+    def line(self, row_id: int) -> bytes:
+        """The line the row was added from, without its newline"""
+        line = self.raw_lines.get(row_id)
+        return line if line is not None else _encode(self.rows[row_id])
+
+    def parse(self, output: "FilterOutput") -> "StepOutput":
+        return StepOutput(
+            output.returncode, self.add(output.stdout),
+            output.stderr.decode(errors="replace"))
+
+
+class StepRows(Sequence):
+    """Rows of a step output, as a sequence of dicts from language to text"""
+
+    def __init__(self, store: RowStore, ids: array,
+                 newline: bool = True) -> None:
+        self.store = store
+        self.ids = ids
+        # whether the last line ended with a newline
+        self.newline = newline
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.store.row(row_id) for row_id in self.ids[index]]
+        return self.store.row(self.ids[index])
+
+    def __add__(self, other: "StepRows") -> "StepRows":
+        """The rows of both, in the store of these"""
+        if other.store is self.store:
+            ids = self.ids + other.ids
+        else:
+            ids = self.ids + self.store.add_lines(other.lines())
+        return StepRows(self.store, ids, other.newline)
+
+    def lines(self) -> Iterator[bytes]:
+        """The line of each row, without newlines"""
+        return map(self.store.line, self.ids)
+
+    def to_bytes(self) -> bytes:
+        """The output the rows were added from"""
+        if not self.ids:
+            return b""
+        return b"\n".join(self.lines()) + (b"\n" if self.newline else b"")
+
+    def column(self, lang: str) -> List[str]:
+        """Text of each row in the given language"""
+        k = self.store.langs.index(lang)
+        rows = self.store.rows
+        return [rows[row_id][k] if k < len(rows[row_id]) else ""
+                for row_id in self.ids]
+
+
+class StepOutput(NamedTuple):
+    """Same as OpusCleaner's `ParsedFilterOutput`, with the rows kept in a
+    `RowStore` shared by the steps"""
+    returncode: int
+    stdout: StepRows
+    stderr: str
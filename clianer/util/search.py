@@ -0,0 +1,93 @@
+"""Search over the rows shown in the dataset view.
+
+Rows are indexed once, with postings of their case-folded word tokens for
+each side. A query matches the rows that contain it (ignoring case) starting
+at the start of a word, so results can be shown while the query is being
+typed. The postings give the rows with a word starting with each word of the
+query, and only these are checked for the query itself. Queries without any
+word characters fall back to a substring scan, and regular expressions are
+matched against every row.
+"""
+
+import re
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+_WORD_RE = re.compile(r"\w+")
+
+# Which sides of the rows a search looks at
+SCOPES = {
+    "both": (0, 1),
+    "source": (0,),
+    "target": (1,),
+}
+
+
+class SearchIndex:
+
+    def __init__(self, rows: Sequence[Tuple[str, str]]):
+        self.rows = rows
+        self.folded: Optional[List[Tuple[str, str]]] = None
+
+        # token -> ascending row indices, for each side
+        self.postings: Tuple[Dict[str, List[int]], ...] = ({}, {})
+        for i, row in enumerate(rows):
+            for side, text in enumerate(row):
+                for token in set(_WORD_RE.findall(text.casefold())):
+                    self.postings[side].setdefault(token, []).append(i)
+
+        self.vocabulary = tuple(sorted(postings) for postings in self.postings)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _prefix_rows(self, side: int, prefix: str) -> Set[int]:
+        """Rows with a word starting with `prefix` on the given side"""
+        vocabulary = self.vocabulary[side]
+        rows: Set[int] = set()
+        for k in range(bisect_left(vocabulary, prefix), len(vocabulary)):
+            if not vocabulary[k].startswith(prefix):
+                break
+            rows.update(self.postings[side][vocabulary[k]])
+        return rows
+
+    def _scan(self, sides: Tuple[int, ...], needle: str) -> List[int]:
+        if self.folded is None:
+            self.folded = [(src.casefold(), tgt.casefold())
+                           for src, tgt in self.rows]
+        return [i for i, row in enumerate(self.folded)
+                if any(needle in row[side] for side in sides)]
+
+    def search(self, query: str, scope: str = "both",
+               regex: bool = False) -> List[int]:
+        """Indices of the matching rows, in ascending order.
+
+        Raises `re.error` for an invalid regular expression.
+        """
+        sides = SCOPES[scope]
+        if not query:
+            return []
+
+        if regex:
+            pattern = re.compile(query, re.IGNORECASE)
+            return [i for i, row in enumerate(self.rows)
+                    if any(pattern.search(row[side]) for side in sides)]
+
+        folded = query.casefold()
+        words = _WORD_RE.findall(folded)
+        if not words:
+            return self._scan(sides, folded)
+
+        candidates: Optional[Set[int]] = None
+        for word in words:
+            rows = set().union(*(self._prefix_rows(side, word) for side in sides))
+            candidates = rows if candidates is None else candidates & rows
+            if not candidates:
+                return []
+
+        # the words may be anywhere in the candidates, in any order
+        pattern = re.compile(
+            (r"(?<!\w)" if _WORD_RE.match(folded) else "") + re.escape(folded))
+        return [i for i in sorted(candidates)
+                if any(pattern.search(self.rows[i][side].casefold())
+                       for side in sides)]
@@ -5,10 +5,12 @@ from typing import Any, Dict
 import urwid
 import urwid.numedit
 
+from clianer.util.filters import get_filter_catalogue
 from clianer.widgets.button import CustomButton
 from clianer.widgets.dialog import Dialog
+from clianer.widgets.sweep import SweepPanel
 from opuscleaner.filters import (
-    get_global_filters, FilterParameter, FilterParameterTuple,
+    get_global_filter, FilterParameter, FilterParameterTuple,
     FilterParameterList, FilterType, FilterParameterFloat, FilterParameterInt,
     FilterParameterBool, FilterParameterStr)
 
@@ -17,14 +19,13 @@ class AddFilterDialog(Dialog):
     """Dialog overlay that lets user choose which filter to add"""
 
     def __init__(self):
-        self.available_filters = get_global_filters()
+        # only the names, the definitions are parsed once one is picked
+        self.available_filters = get_filter_catalogue().sorted_names()
 
         self.buttons = []
-        for name, filter_spec in sorted(
-                self.available_filters.items(), key=lambda x: x[0]):
+        for name in self.available_filters:
             self.buttons.append(
-                CustomButton(filter_spec.name, on_press=self.add_filter,
-                             user_data=filter_spec))
+                CustomButton(name, on_press=self.add_filter, user_data=name))
 
         self.listbox = urwid.ListBox(urwid.SimpleFocusListWalker(self.buttons))
         #self.top = urwid.LineBox(self.listbox, title="New filter")
@@ -32,8 +33,14 @@ class AddFilterDialog(Dialog):
         urwid.register_signal(self.__class__, ["close"])
         super().__init__(self.listbox, "New filter", width=50, height=35)
 
-    def add_filter(self, button, filter_obj):
-        self._emit("close", filter_obj)
+    def add_filter(self, button, name):
+        try:
+            filter_spec = get_global_filter(name)
+        except KeyError:
+            # the definition is not valid, it is gone from the list now
+            button.set_label(f"{name} (invalid)")
+            return
+        self._emit("close", filter_spec)
 
     def keypress(self, size, key):
         if key in string.ascii_letters:
@@ -58,6 +65,10 @@ class EditFilterDialog(Dialog):
         self.description_widget = urwid.Text(description)
 
         self.filter_args: Dict[str, Any] = {}
+        # numeric parameters, which can be swept, and their editors
+        self.numeric_params: Dict[str, Any] = {}
+        self.sweep_buttons = []
+        self.sweep = None
 
         self.mono_lang_selector = []
         self.filter_type_widget_list = []
@@ -102,9 +113,12 @@ class EditFilterDialog(Dialog):
             self.parameters_widget,
             urwid.Divider(),
             self.buttons])
+        # the parameters, or a sweep of one of them
+        self.placeholder = urwid.WidgetPlaceholder(self.top)
 
-        urwid.register_signal(self.__class__, ["close"])
-        super().__init__(self.top, self.filter_spec.name, width=60, height=40)
+        urwid.register_signal(self.__class__, ["close", "sweep"])
+        super().__init__(
+            self.placeholder, self.filter_spec.name, width=60, height=40)
 
     def _add_parameter_widgets(self, name: str, param: FilterParameter):
         #self.parameter_widget_list.append(urwid.Text(name, align="left"))
@@ -138,7 +152,7 @@ class EditFilterDialog(Dialog):
                 editor = urwid.Edit(("dialog edit caption", name + ": "))
 
             getter = editor.get_edit_text
-            editor = urwid.AttrMap(editor, "dialog edit", "dialog edit focus")
+            editor = self._sweepable(name, param, editor)
 
         if isinstance(param, FilterParameterInt):
             if self.default_args is not None:
@@ -148,7 +162,7 @@ class EditFilterDialog(Dialog):
                 editor = urwid.IntEdit(("dialog edit caption", name + " "),
                                        param.default)
             getter = editor.value
-            editor = urwid.AttrMap(editor, "dialog edit", "dialog edit focus")
+            editor = self._sweepable(name, param, editor)
 
         if isinstance(param, FilterParameterBool):
             if self.default_args is not None:
@@ -181,7 +195,62 @@ class EditFilterDialog(Dialog):
         self.parameter_widget_list.append(editor)
         self.parameter_widget_list.append(urwid.Divider())
 
+    def _sweepable(self, name, param, editor):
+        """The editor of a numeric parameter, with a button to sweep it"""
+        self.numeric_params[name] = (param, editor)
+        sweep_button = CustomButton(
+            "Sweep", on_press=self.open_sweep, user_data=name)
+        self.sweep_buttons.append(sweep_button)
+        return urwid.Columns([
+            urwid.AttrMap(editor, "dialog edit", "dialog edit focus"),
+            ("fixed", 7, sweep_button)], 1)
+
+    def open_sweep(self, button, name):
+        param, editor = self.numeric_params[name]
+        self.sweep = SweepPanel(name, param, editor.get_edit_text())
+        urwid.connect_signal(
+            self.sweep, "run", lambda w, values: self.run_sweep(name, values))
+        urwid.connect_signal(
+            self.sweep, "pick", lambda w, value: self.pick(name, value))
+        urwid.connect_signal(self.sweep, "back", lambda w: self.close_sweep())
+        self.placeholder.original_widget = self.sweep
+
+    def run_sweep(self, name, values):
+        """Ask for the filter to run with each of the values of the
+        parameter, and the other parameters as they are"""
+        args = {k: v() for k, v in self.filter_args.items()}
+        param, _ = self.numeric_params[name]
+        if isinstance(param, FilterParameterFloat):
+            # same as typed in the editor
+            values = [str(value) for value in values]
+
+        self._emit("sweep", [{**args, name: value} for value in values],
+                   self.mono_lang_selector[0].state
+                   if self.mono_lang_selector else None)
+
+    def show_sweep_results(self, results):
+        if self.sweep is not None:
+            self.sweep.show_results(results)
+
+    def sweep_finished(self, error=None):
+        if self.sweep is not None:
+            self.sweep.finished(error)
+
+    def pick(self, name, value):
+        _, editor = self.numeric_params[name]
+        editor.set_edit_text(str(value))
+        self.close_sweep()
+
+    def close_sweep(self):
+        self.sweep = None
+        self.placeholder.original_widget = self.top
+        self._emit("sweep", None)
+
     def keypress(self, size, key):
+        if self.sweep is not None:
+            # the sweep handles its keys, esc goes back to the parameters
+            return self._w.keypress(size, key)
+
         if key == "esc":
             self.cancel(None)
         if key == "enter":
@@ -189,6 +258,8 @@ class EditFilterDialog(Dialog):
             focus = self.top.get_focus_widgets()[-1]
             if focus == self.cancel_button:
                 self.cancel(None)
+            elif focus in self.sweep_buttons:
+                return super().keypress(size, key)
             else:
                 self.save(None)
         else:
@@ -1,6 +1,80 @@
+import re
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
 import urwid
 
-from clianer.util.diff import diff_bitexts
+from clianer.util.diff import diff_bitexts, diff_bitexts_by_origin
+from clianer.util.search import SCOPES, SearchIndex
+
+
+class RowWalker(urwid.ListWalker):
+    """List walker that builds row widgets lazily.
+
+    Widgets are created only for the rows urwid asks for (i.e. the visible
+    window), and the most recently built ones are kept in a small LRU cache.
+    The rows themselves can be any sequence.
+    """
+
+    def __init__(self, rows, make_row, cache_size=256):
+        self.rows = rows
+        self.make_row = make_row
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.focus = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, position):
+        widget = self.cache.get(position)
+        if widget is None:
+            widget = self.make_row(self.rows[position])
+            self.cache[position] = widget
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(position)
+
+        return widget
+
+    def get_focus(self):
+        if not self.rows:
+            return None, None
+        return self[self.focus], self.focus
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def get_next(self, position):
+        if position + 1 >= len(self.rows):
+            return None, None
+        return self[position + 1], position + 1
+
+    def get_prev(self, position):
+        if position <= 0:
+            return None, None
+        return self[position - 1], position - 1
+
+    def positions(self, reverse=False):
+        if reverse:
+            return range(len(self.rows) - 1, -1, -1)
+        return range(len(self.rows))
+
+
+def _markup_text(markup):
+    """Plain text of urwid text markup and whether any of it has an
+    attribute (i.e. is highlighted as changed in a diff)."""
+    if isinstance(markup, str):
+        return markup, False
+
+    if isinstance(markup, tuple):
+        text, _ = _markup_text(markup[1])
+        return text, markup[0] is not None
+
+    parts = [_markup_text(part) for part in markup]
+    return "".join(text for text, _ in parts), any(c for _, c in parts)
 
 
 class DatasetView(urwid.WidgetWrap):
@@ -9,50 +83,333 @@ class DatasetView(urwid.WidgetWrap):
         self.datacols = urwid.ListBox(urwid.SimpleFocusListWalker([
                 urwid.Text("Press F2 to load a dataset.")]))
         self.draw_lines = draw_lines
+        self.title = None
+        self.loading = False
+        self.progress = None
+        # message shown after the title until the title changes
+        self.status = None
+        self.intraline = False
+        self.diff_args = None
+
+        # search state, the index is built on the first search in the rows
+        self.search_rows = None
+        self.search_index = None
+        self.hunks = None
+        self.changed = None
+        self.query = ""
+        self.scope = "both"
+        self.regex = False
+        self.matches = []
+        self.search_start = 0
+
+        self.search_edit = urwid.Edit()
+        urwid.connect_signal(
+            self.search_edit, "postchange", lambda *args: self.search())
+        self.goto_edit = urwid.IntEdit()
 
         listbox = urwid.Padding(
             self.datacols, ("fixed left", 1), ("fixed right", 1))
         listbox = urwid.AttrMap(listbox, attr_map="data")
+        self.frame = urwid.Frame(listbox)
 
         self.linebox = urwid.LineBox(
-            listbox, title=f"No dataset loaded",
+            self.frame, title=f"No dataset loaded",
             title_align="left", title_attr="heading")
 
         super().__init__(self.linebox)
 
-    def show(self, data, title=None):
-        self.datacols.body.clear()
+    @property
+    def prompting(self):
+        """Whether the search or the go to row bar has the focus"""
+        return self.frame.footer is not None \
+            and self.frame.focus_position == "footer"
+
+    def set_title(self, title):
+        self.title = title
+        self.status = None
+        self._update_title()
+
+    def set_status(self, status):
+        self.status = status
+        self._update_title()
+
+    def set_loading(self, loading, progress=None):
+        self.loading = loading
+        self.progress = progress
+        self._update_title()
+
+    def _update_title(self):
+        if self.title is None:
+            title = "No dataset loaded"
+        else:
+            title = f"Dataset: {self.title}"
+
+        if self.loading and self.progress is not None:
+            title += f" (loading {self.progress}...)"
+        elif self.loading:
+            title += " (loading...)"
+        elif self.status is not None:
+            title += f" ({self.status})"
+
+        self.linebox.set_title(title)
 
-        langs = data[0].keys()
-        assert len(langs) == 2
-        src, tgt = langs
+    def _make_row(self, left, right):
+        cols = urwid.Columns(
+            [urwid.Text(left), urwid.Text(right)], dividechars=1)
+        cols._selectable = True
+        row = urwid.AttrMap(cols, attr_map="data", focus_map="focus data")
 
-        for entry in data:
+        if self.draw_lines:
+            row = urwid.Pile([row, urwid.Divider("─")])
+
+        return row
+
+    def show(self, data, title=None, searchable=True):
+        """Show the rows of `data`, a sequence of dicts from the language to
+        the text of the row. Rows are only read when they are displayed.
+
+        Searching needs to index all the rows, so it can be turned off for
+        big sequences.
+        """
+        if data:
+            langs = data[0].keys()
+            assert len(langs) == 2
+            src, tgt = langs
+
+        def make_row(entry):
             assert src in entry.keys() and tgt in entry.keys()
-            cols = urwid.Columns(
-                [urwid.Text(entry[src]), urwid.Text(entry[tgt])],
-                dividechars=1)
-            cols._selectable = True
-            self.datacols.body.append(
-                urwid.AttrMap(cols, attr_map="data", focus_map="focus data"))
-            if self.draw_lines:
-                self.datacols.body.append(urwid.Divider("─"))
+            return self._make_row(entry[src], entry[tgt])
+
+        self.datacols.body = RowWalker(data, make_row)
+        self.diff_args = None
+
+        if not searchable:
+            self.search_rows = None
+            self.search_index = None
+            self.hunks = None
+        elif data is not self.search_rows:
+            self.search_rows = data
+            self.search_index = None
+            self.hunks = None
 
         if title is not None:
-            self.linebox.set_title(f"Dataset: {title}")
+            self.set_title(title)
+
+
+    def show_diff(self, rev1_src, rev1_tgt, rev2_src, rev2_tgt, title=None,
+                  origins=None, changed_only=False):
+        """Show diff of two revisions.
 
+        If `origins` is a pair of row origin lists of the two revisions, the
+        diff is computed by merging on them instead of a general diff. With
+        `changed_only`, the rows which are the same in both are left out.
+        """
+        self.diff_args = (rev1_src, rev1_tgt, rev2_src, rev2_tgt, title,
+                          origins, changed_only)
 
-    def show_diff(self, rev1_src, rev1_tgt, rev2_src, rev2_tgt, title=None):
+        if origins is not None:
+            rev1_origins, rev2_origins = origins
+            bitext_diff = diff_bitexts_by_origin(
+                rev1_src, rev1_tgt, rev1_origins,
+                rev2_src, rev2_tgt, rev2_origins, intraline=self.intraline)
+        else:
+            bitext_diff = diff_bitexts(rev1_src, rev1_tgt, rev2_src, rev2_tgt,
+                                       intraline=self.intraline)
 
-        bitext_diff = diff_bitexts(rev1_src, rev1_tgt, rev2_src, rev2_tgt)
+        if changed_only:
+            bitext_diff = [
+                (left, right) for left, right in bitext_diff
+                if _markup_text(left)[1] or _markup_text(right)[1]]
 
         # note that left and right are already urwid texts.
-        self.datacols.body.clear()
-        for (left, right) in bitext_diff:
-            cols = urwid.Columns(
-                [urwid.Text(left), urwid.Text(right)], dividechars=1)
-            cols._selectable = True
-            self.datacols.body.append(
-                urwid.AttrMap(cols, attr_map="data", focus_map="focus data"))
-            if self.draw_lines:
-                self.datacols.body.append(urwid.Divider("─"))
+        self.datacols.body = RowWalker(
+            bitext_diff, lambda markup: self._make_row(*markup))
+
+        self.search_rows = bitext_diff
+        self.search_index = None
+        self.hunks = None
+
+        if title is not None:
+            self.set_title(title)
+
+    def _build_search_index(self):
+        rows = self.search_rows or []
+
+        if self.diff_args is None:
+            if rows:
+                src, tgt = rows[0].keys()
+                self.search_index = SearchIndex(
+                    [(entry[src], entry[tgt]) for entry in rows])
+            else:
+                self.search_index = SearchIndex([])
+            return
+
+        # diff rows are markup, search their text and remember which rows
+        # are changed to jump between hunks
+        texts, changed = [], []
+        for left, right in rows:
+            (src, src_changed), (tgt, tgt_changed) = \
+                _markup_text(left), _markup_text(right)
+            texts.append((src, tgt))
+            changed.append(src_changed or tgt_changed)
+
+        self.search_index = SearchIndex(texts)
+        self.hunks = [
+            i for i, c in enumerate(changed)
+            if c and (i == 0 or not changed[i - 1])]
+        self.changed = changed
+
+    def _find_matches(self):
+        if self.search_index is None:
+            self._build_search_index()
+
+        try:
+            rows = self.search_index.search(self.query, self.scope, self.regex)
+        except re.error:
+            rows = []
+
+        if self.hunks is None:
+            return rows
+
+        # in a diff, matches are the hunks with a match in a changed row,
+        # or all hunks if there is no query
+        if not self.query:
+            return self.hunks
+
+        hunk_starts = []
+        for row in rows:
+            if not self.changed[row]:
+                continue
+            start = self.hunks[bisect_right(self.hunks, row) - 1]
+            if not hunk_starts or hunk_starts[-1] != start:
+                hunk_starts.append(start)
+        return hunk_starts
+
+    def _update_caption(self):
+        options = self.scope + (", regex" if self.regex else "")
+        if self.query:
+            count = f" {len(self.matches)} found"
+        else:
+            count = ""
+        self.search_edit.set_caption(f"Search ({options}){count}: ")
+
+    def open_search(self):
+        if not isinstance(self.datacols.body, RowWalker) \
+                or self.search_rows is None:
+            return
+
+        self.search_start = self.datacols.body.focus
+        self.search_edit.set_edit_text("")
+        self.frame.footer = urwid.AttrMap(self.search_edit, "dialog edit")
+        self.frame.focus_position = "footer"
+        self._update_caption()
+
+    def close_search(self, cancel=False):
+        self.frame.focus_position = "body"
+        self.frame.footer = None
+        if cancel:
+            self._focus_row(self.search_start)
+
+    def open_goto(self):
+        body = self.datacols.body
+        if not isinstance(body, RowWalker) or not len(body):
+            return
+
+        self.goto_edit.set_caption(f"Go to row (1-{len(body)}): ")
+        self.goto_edit.set_edit_text("")
+        self.frame.footer = urwid.AttrMap(self.goto_edit, "dialog edit")
+        self.frame.focus_position = "footer"
+
+    def search(self):
+        """Incremental search from where the search started"""
+        self.query = self.search_edit.edit_text
+        self.matches = self._find_matches()
+        self._update_caption()
+
+        if self.query and self.matches:
+            self._jump(self.search_start, forward=True, inclusive=True)
+
+    def _focus_row(self, position):
+        body = self.datacols.body
+        if isinstance(body, RowWalker) and len(body):
+            self.datacols.set_focus(min(position, len(body) - 1))
+            self.datacols.set_focus_valign("middle")
+
+    def _jump(self, position, forward=True, inclusive=False):
+        """Focus the next (or previous) match from `position`, wrapping
+        around the ends."""
+        if not self.matches:
+            return
+
+        if forward:
+            bisect = bisect_left if inclusive else bisect_right
+            k = bisect(self.matches, position)
+            target = self.matches[k % len(self.matches)]
+        else:
+            k = bisect_left(self.matches, position)
+            target = self.matches[k - 1]
+
+        self._focus_row(target)
+
+    def next_match(self, forward=True):
+        body = self.datacols.body
+        if not isinstance(body, RowWalker) or self.search_rows is None:
+            return
+
+        # the rows may have changed since the last search
+        self.matches = self._find_matches()
+        self._jump(body.focus, forward)
+
+    def keypress(self, size, key):
+        if self.prompting and self.frame.footer.base_widget is self.goto_edit:
+            if key == "enter":
+                if self.goto_edit.edit_text:
+                    self._focus_row(max(self.goto_edit.value() - 1, 0))
+                self.close_search()
+            elif key == "esc":
+                self.close_search()
+            else:
+                return super().keypress(size, key)
+            return None
+
+        if self.prompting:
+            if key == "enter":
+                self.close_search()
+            elif key == "esc":
+                self.close_search(cancel=True)
+            elif key == "tab":
+                scopes = list(SCOPES)
+                self.scope = scopes[(scopes.index(self.scope) + 1) % len(scopes)]
+                self.search()
+            elif key == "ctrl r":
+                self.regex = not self.regex
+                self.search()
+            else:
+                return super().keypress(size, key)
+            return None
+
+        if key == "/":
+            self.open_search()
+            return None
+
+        if key == "g":
+            self.open_goto()
+            return None
+
+        if key == "n" or key == "N":
+            self.next_match(forward=key == "n")
+            return None
+
+        if key == "i":
+            # toggle intra-line diff highlighting
+            self.intraline = not self.intraline
+            if self.diff_args is not None:
+                focus = self.datacols.focus_position \
+                    if len(self.datacols.body) else None
+                self.show_diff(*self.diff_args)
+                if focus is not None and len(self.datacols.body):
+                    self.datacols.body.set_focus(
+                        min(focus, len(self.datacols.body) - 1))
+            return None
+
+        return super().keypress(size, key)
@@ -8,6 +8,14 @@ EXPANDED_ICON = "[-]"
 EMPTY_ICON = "[ ]"
 
 
+def filter_step(filter_spec, filter_args, filter_lang=None):
+    """Pipeline step running the filter with the given arguments"""
+    if filter_spec.type == FilterType.MONOLINGUAL:
+        return FilterStep(filter=filter_spec.name,
+                          parameters=filter_args, language=filter_lang)
+    return FilterStep(filter=filter_spec.name, parameters=filter_args)
+
+
 class FilterItem(urwid.WidgetWrap):
     def __init__(self, filter_spec, filter_args, filter_lang=None):
         self.caption = filter_spec.name
@@ -17,8 +25,12 @@ class FilterItem(urwid.WidgetWrap):
 
         self.header = urwid.SelectableIcon(
             self.format_text(icon), cursor_position=1)
+        self.stats = urwid.Text("", align="right")
 
-        self.styled_header = urwid.AttrMap(self.header, "filter", "filter selected")
+        self.styled_header = urwid.AttrMap(
+            urwid.Columns([self.header, ("pack", self.stats)], dividechars=1),
+            {None: "filter", "filter slow": "filter slow"},
+            {None: "filter selected", "filter slow": "filter slow selected"})
 
         self.expanded = False
         self.diff = False
@@ -40,11 +52,29 @@ class FilterItem(urwid.WidgetWrap):
         self.diff = not self.diff
 
         if self.diff:
-            self.styled_header.set_attr_map({None: "filter diff"})
-            self.styled_header.set_focus_map({None: "filter diff selected"})
+            self.styled_header.set_attr_map(
+                {None: "filter diff", "filter slow": "filter slow"})
+            self.styled_header.set_focus_map(
+                {None: "filter diff selected",
+                 "filter slow": "filter slow selected"})
         else:
-            self.styled_header.set_attr_map({None: "filter"})
-            self.styled_header.set_focus_map({None: "filter selected"})
+            self.styled_header.set_attr_map(
+                {None: "filter", "filter slow": "filter slow"})
+            self.styled_header.set_focus_map(
+                {None: "filter selected", "filter slow": "filter slow selected"})
+
+    def set_stats(self, stats, slowest=False):
+        """Show statistics of the last run of the step (`StepStats` or
+        `None` if the step did not run)."""
+        if stats is None:
+            self.stats.set_text("")
+            self.body.set_stats(None)
+            return
+
+        change = -stats.drop_rate or 0.0 # no "-0%"
+        text = f"{stats.wall_time:.2f}s {change:+.0%}"
+        self.stats.set_text(("filter slow", text) if slowest else text)
+        self.body.set_stats(stats)
 
     def format_text(self, icon):
         return icon + " " + self.caption
@@ -71,9 +101,26 @@ class FilterItemBody(urwid.WidgetWrap):
                                     urwid.Text(str(val), align="right")]))
             self.empty = False
 
+        self.stats = urwid.Text("", align="left")
+
         self.top = urwid.Pile(cols)
         super().__init__(self.top)
 
+    def set_stats(self, stats):
+        in_pile = any(w is self.stats for w, _ in self.top.contents)
+
+        if stats is None:
+            if in_pile:
+                self.top.contents.pop()
+            return
+
+        self.stats.set_text(
+            f"Time: {stats.wall_time:.2f}s (CPU {stats.cpu_time:.2f}s)\n"
+            f"Lines: {stats.input_lines} -> {stats.output_lines}"
+            f" ({stats.drop_rate:.1%} dropped)")
+        if not in_pile:
+            self.top.contents.append((self.stats, self.top.options()))
+
 
 class FilterList(urwid.WidgetWrap):
     def __init__(self, filters=None):
@@ -87,6 +134,11 @@ class FilterList(urwid.WidgetWrap):
             for filter_step in filters:
                 self.add_filter(filter_step)
 
+        # the pipeline can be forked into variants A and B to compare them,
+        # `filters` are the ones of the variant being edited
+        self.variant = "A"
+        self.other_filters = None
+
         self.diff_start = None
         self.diff_end = None
 
@@ -124,14 +176,78 @@ class FilterList(urwid.WidgetWrap):
         self.listWalker.pop(filter_index)
         self._emit("filter_update")
 
-    def get_filters(self):
-        for (filter_spec, filter_args, filter_lang) in self.filters:
-            if filter_spec.type == FilterType.MONOLINGUAL:
-                yield FilterStep(filter=filter_spec.name,
-                                 parameters=filter_args, language=filter_lang)
-            else:
-                yield FilterStep(filter=filter_spec.name,
-                                 parameters=filter_args)
+    def set_stats(self, stats, filters=None):
+        """Show statistics of the last pipeline run next to the filters,
+        highlighting the slowest one. `stats` has an item per filter and
+        can be shorter if the pipeline stopped early.
+
+        `filters` are the steps of the run, if the filters were edited since
+        (or the other variant is edited) the statistics are dropped, as they
+        would be shown next to the wrong filters."""
+        if filters is not None and list(filters) != list(self.get_filters()):
+            return
+
+        stats = list(stats)[:len(self.listWalker)]
+        stats += [None] * (len(self.listWalker) - len(stats))
+
+        times = [s.wall_time for s in stats if s is not None]
+        slowest = max(times) if len(times) > 1 else None
+
+        for item, step_stats in zip(self.listWalker, stats):
+            item.set_stats(step_stats, slowest=step_stats is not None
+                           and step_stats.wall_time == slowest)
+
+    @property
+    def other_variant(self):
+        return "B" if self.variant == "A" else "A"
+
+    def _show_variant(self):
+        self.untoggle_all_diffs()
+        self.listWalker[:] = [FilterItem(*f) for f in self.filters]
+
+        if self.other_filters is None:
+            self.top.set_title("Filters")
+        else:
+            self.top.set_title(f"Filters (variant {self.variant})")
+
+    def fork_variant(self):
+        """Copy the pipeline into variant B and edit the copy"""
+        if self.other_filters is not None:
+            return
+
+        self.other_filters = list(self.filters)
+        self.variant = "B"
+        self._show_variant()
+        self._emit("filter_update")
+
+    def switch_variant(self):
+        """Edit the other variant"""
+        if self.other_filters is None:
+            return
+
+        self.filters, self.other_filters = self.other_filters, self.filters
+        self.variant = self.other_variant
+        self._show_variant()
+        self._emit("filter_update")
+
+    def keep_variant(self):
+        """Drop the other variant, the edited one becomes the pipeline"""
+        if self.other_filters is None:
+            return
+
+        self.other_filters = None
+        self.variant = "A"
+        self._show_variant()
+        self._emit("filter_update")
+
+    def get_filters(self, variant=None):
+        """Steps of the edited pipeline, or of the given variant of it"""
+        filters = self.filters
+        if variant is not None and variant != self.variant:
+            filters = self.other_filters
+
+        for (filter_spec, filter_args, filter_lang) in filters:
+            yield filter_step(filter_spec, filter_args, filter_lang)
 
     def clear_filters(self):
         self.filters = []
@@ -202,6 +318,15 @@ class FilterList(urwid.WidgetWrap):
         if key == "r":
             self.untoggle_all_diffs()
 
+        if key == "v":
+            if self.other_filters is None:
+                self.fork_variant()
+            else:
+                self.switch_variant()
+
+        if key == "V":
+            self.keep_variant()
+
         if key == "w":
             # move focused filter up
             index = self.get_focused_filter_index()
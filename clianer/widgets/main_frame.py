@@ -1,19 +1,32 @@
 import asyncio
+import os
+import threading
+import zlib
 import urwid
 
-from opuscleaner.server import get_sample
-from opuscleaner.server import ParsedFilterOutput, FilterPipelinePatch, \
-    api_get_dataset_filters, api_update_dataset_filters
 from opuscleaner.filters import get_global_filter
 
+from clianer.util.corpus import CorpusCache
+from clianer.util.diff import bitext_rows, compare_origins, track_origins
+from clianer.util.pipeline import (
+    HeadSample, RandomSample, StepCache, run_sweep, run_variants,
+    run_variants_progressive)
 from clianer.widgets.dataset_view import DatasetView
-from clianer.widgets.filter_list import FilterList
+from clianer.widgets.filter_list import FilterList, filter_step
 from clianer.widgets.add_filter import AddFilterDialog, EditFilterDialog
 from clianer.widgets.select_dataset import SelectDatasetDialog
-from clianer.widgets.assign_category import AssignCategoriesDialog
 from clianer.widgets.dialog import ErrorDialog
+from clianer.widgets.sample_size import SampleSizeDialog
 
 
+# Filter list changes arriving within this many seconds of each other are
+# coalesced into a single pipeline run and a single write of the pipeline.
+FILTER_UPDATE_DELAY = 0.3
+
+# Errors of making a copy of a dataset that are shown instead of browsing it,
+# such as a truncated or corrupt gzip file
+BUILD_ERRORS = (OSError, EOFError, zlib.error)
+
 class ClianerFrame(urwid.WidgetWrap):
     def __init__(self):
         self.dialog = None
@@ -21,10 +34,35 @@ class ClianerFrame(urwid.WidgetWrap):
         self.dataset = None
         self.dataset_view = DatasetView()
         self.langs = ["en", "ga"]
+        self.step_cache = StepCache()
+        self.main_loop = None
+
+        # number of rows from the start of the dataset (or random ones) to
+        # load, or None for OpusCleaner's sample
+        self.sample_size = None
+        self.sample_random = False
+        self.row_sample = None
+
+        # rows of the whole dataset when browsing it, and the event stopping
+        # the copy of the dataset made for that
+        self.corpus_rows = None
+        self.browse_cancel = None
+
+        self.loaded_data = []
+        self.origins = None
+        # outputs of the other variant of the pipeline, if it is forked
+        self.other_data = None
+        self.other_origins = None
+        self.loading_task = None
+        self.sweep_task = None
+        self.pending_error = None
+        self.filter_update_alarm = None
 
         self.rev1 = 0
         self.rev2 = -1
-        self.showing_diff = False
+        # what the dataset view shows: "orig", "clean", "diff", "compare"
+        # (the variants of the pipeline) or "browse"
+        self.showing = "clean"
 
         self.body = urwid.Columns([(40, self.filter_list), self.dataset_view])
         self.header = urwid.AttrMap(urwid.Text("  File"), "options")
@@ -37,6 +75,7 @@ class ClianerFrame(urwid.WidgetWrap):
             urwid.Text([("options key", "F6"), "Show Clean"]),
             urwid.Text([("options key", "F7"), "Categories"]),
             urwid.Text([("options key", "F8"), "Remove Filter"]),
+            urwid.Text([("options key", "F9"), "Sample Size"]),
             urwid.Text([("options key", "F10"), "Quit"])
         ]), "options")
 
@@ -44,11 +83,7 @@ class ClianerFrame(urwid.WidgetWrap):
             self.body, header=self.header, footer=self.footer)
 
         def filters_updated(*args):
-            if self.dataset:
-                self.update_data()
-                api_update_dataset_filters(
-                    self.dataset,
-                    FilterPipelinePatch(filters=list(self.filter_list.get_filters())))
+            self.schedule_filters_update()
 
         def diff_updated(w):
             if w.diff_start is not None:
@@ -62,6 +97,10 @@ class ClianerFrame(urwid.WidgetWrap):
         super().__init__(self.top)
 
     def keypress(self, size, key):
+        if self.dataset_view.prompting:
+            # everything typed goes to the search (or go to row) bar
+            return super().keypress(size, key)
+
         focus_column = self.body.get_focus_column()
 
         if key == "q" or key == "Q" or key == "f10":
@@ -99,6 +138,12 @@ class ClianerFrame(urwid.WidgetWrap):
         if key == "f6":
             self.show_clean()
 
+        if key == "b" and focus_column == 1 and self.dialog is None:
+            self.browse()
+
+        if key == "c" and focus_column == 1 and self.dialog is None:
+            self.show_compare()
+
         if key == "f7":
             if self.dialog is None and self.dataset is not None:
                self.openAssignCategoriesDialog()
@@ -107,6 +152,10 @@ class ClianerFrame(urwid.WidgetWrap):
             index = self.filter_list.get_focused_filter_index()
             self.filter_list.remove_filter(index)
 
+        if key == "f9":
+            if self.dialog is None:
+                self.openSampleSizeDialog()
+
         return super().keypress(size, key)
 
     def openDialog(self, widget, tag, callback=None, user_args=None):
@@ -123,6 +172,10 @@ class ClianerFrame(urwid.WidgetWrap):
             if callback is not None:
                 callback(widget, *args, **kwargs)
 
+            if self.dialog is None and self.pending_error is not None:
+                error_msg, self.pending_error = self.pending_error, None
+                self.openErrorDialog(error_msg)
+
         urwid.connect_signal(
             self._w[1], "close", callback_wrapper)
 
@@ -139,15 +192,19 @@ class ClianerFrame(urwid.WidgetWrap):
             self, index, filter_spec, filter_args=None, filter_lang=None):
         widget = EditFilterDialog(filter_spec, filter_args, filter_lang)
 
-        def edit_filter_closed(widget, filter_spec, filter_args,
+        def sweep(widget, filter_args_list, filter_lang_is_src=None):
+            if filter_args_list is None:
+                self.stop_sweep()
+            else:
+                self.start_sweep(widget, index, filter_spec, filter_args_list,
+                                 self.get_filter_lang(filter_lang_is_src))
+
+        def edit_filter_closed(widget, filter_spec, filter_args=None,
                                filter_lang_is_src=None):
+            self.stop_sweep()
             if filter_args is not None:
                 assert filter_spec is not None
-                lang = None
-                if filter_lang_is_src:
-                    lang = self.langs[0]
-                if filter_lang_is_src is False:
-                    lang = self.langs[1]
+                lang = self.get_filter_lang(filter_lang_is_src)
 
                 if index is None:
                     self.filter_list.add_filter(filter_spec, filter_args, lang)
@@ -155,21 +212,103 @@ class ClianerFrame(urwid.WidgetWrap):
                     self.filter_list.update_filter(
                         index, filter_spec, filter_args, lang)
 
+        urwid.connect_signal(widget, "sweep", sweep)
         self.openDialog(widget, "edit_filter", edit_filter_closed)
 
+    def get_filter_lang(self, filter_lang_is_src):
+        if filter_lang_is_src:
+            return self.langs[0]
+        if filter_lang_is_src is False:
+            return self.langs[1]
+        return None
+
+    def start_sweep(self, dialog, index, filter_spec, filter_args_list,
+                    filter_lang):
+        """Run the filter being edited with each of the arguments, on the
+        output of the filters before it, and show the results in the
+        dialog. `index` is the position of the filter, None for a new one."""
+        self.stop_sweep()
+        if self.dataset is None:
+            dialog.sweep_finished("No dataset is open.")
+            return
+
+        filters = list(self.filter_list.get_filters())
+        if index is not None:
+            filters = filters[:index]
+
+        try:
+            steps = [filter_step(filter_spec, filter_args, filter_lang)
+                     for filter_args in filter_args_list]
+        except ValueError as e:
+            dialog.sweep_finished(str(e))
+            return
+
+        sample = None
+        if self.sample_size is not None:
+            sample = self.get_row_sample()
+
+        async def sweep():
+            async for results in run_sweep(self.dataset, sample,
+                                           self.sample_size, filters, steps,
+                                           self.step_cache):
+                dialog.show_sweep_results(results)
+                self.redraw()
+
+        def sweep_done(task):
+            if task is not self.sweep_task:
+                return
+            self.sweep_task = None
+
+            error = task.exception()
+            dialog.sweep_finished(str(error) if error is not None else None)
+            self.redraw()
+
+        self.sweep_task = asyncio.ensure_future(sweep())
+        self.sweep_task.add_done_callback(sweep_done)
+
+    def stop_sweep(self):
+        if self.sweep_task is not None:
+            self.sweep_task.cancel()
+            self.sweep_task = None
+
     def openSelectDatasetDialog(self):
-        widget = SelectDatasetDialog("Open Dataset", self.dataset)
+        widget = SelectDatasetDialog(
+            "Open Dataset", self.dataset, main_loop=self.main_loop)
         self.openDialog(widget, "sel_dataset", self.selectDatasetDialogClosed)
 
     def openImportFilterDialog(self):
-        widget = SelectDatasetDialog("Import Dataset Filters", self.dataset)
+        widget = SelectDatasetDialog(
+            "Import Dataset Filters", self.dataset, main_loop=self.main_loop)
         self.openDialog(widget, "import_filter", self.importFilterDialogClosed)
 
     def openAssignCategoriesDialog(self):
+        # imported on first use, like the server functions below, as
+        # OpusCleaner's categories and server modules load its web app
+        from clianer.widgets.assign_category import AssignCategoriesDialog
+
         widget = AssignCategoriesDialog(self.dataset)
         self.openDialog(widget, "assign_categories")
 
+    def openSampleSizeDialog(self):
+        widget = SampleSizeDialog(self.sample_size, self.sample_random)
+
+        def sample_size_closed(widget, size, random=False):
+            if size is None or ((size or None), random) \
+                    == (self.sample_size, self.sample_random):
+                return
+            self.sample_size = size or None
+            self.sample_random = random
+            if self.dataset is not None:
+                self.update_data()
+
+        self.openDialog(widget, "sample_size", sample_size_closed)
+
     def openErrorDialog(self, error_msg):
+        if self.dialog is not None:
+            # show the error once the user closes the current dialog
+            self.pending_error = error_msg
+            return
+
         widget = ErrorDialog(error_msg)
         self.openDialog(widget, "error")
 
@@ -183,6 +322,8 @@ class ClianerFrame(urwid.WidgetWrap):
             self.import_filters(dataset_name_and_langs[0])
 
     def import_filters(self, dataset_name):
+        from opuscleaner.server import api_get_dataset_filters
+
         self.filter_list.set_signal_emit("filter_update", False)
 
         filters = api_get_dataset_filters(dataset_name)
@@ -194,9 +335,15 @@ class ClianerFrame(urwid.WidgetWrap):
         self.filter_list.set_signal_emit("filter_update", True)
 
     def open_dataset(self, name, langs):
+        from opuscleaner.server import api_get_dataset_filters
+
         # TODO ask to save filters
+        self.flush_filters_update()
+        self.stop_browse()
+        self.showing = "clean"
         self.dataset = None
         self.langs = langs
+        self.filter_list.keep_variant()
         self.filter_list.clear_filters()
         pipeline = api_get_dataset_filters(name)
         for step in pipeline.filters:
@@ -206,50 +353,378 @@ class ClianerFrame(urwid.WidgetWrap):
         self.update_data()
 
     def show_orig(self):
+        if not self.loaded_data:
+            return
         self.dataset_view.show(self.loaded_data[0].stdout, title=self.dataset)
+        self.close_browse_rows()
+        self.showing = "orig"
 
     def show_clean(self):
+        if not self.loaded_data:
+            return
         self.dataset_view.show(self.loaded_data[-1].stdout, title=self.dataset)
+        self.close_browse_rows()
+        self.showing = "clean"
+
+    def browse(self):
+        """Show all rows of the dataset, making a copy of it first if there
+        is none (see `CorpusCache`)"""
+        if self.dataset is None:
+            return
+
+        self.stop_browse()
+        corpus = CorpusCache(self.dataset)
+        if corpus.is_built():
+            self.show_browse(corpus)
+            return
+
+        if self.main_loop is None:
+            try:
+                corpus.build()
+            except BUILD_ERRORS as e:
+                self.dataset_view.set_status(f"Could not copy the dataset: {e}")
+                return
+            self.show_browse(corpus)
+            return
+
+        cancel = threading.Event()
+        progress = []
+        errors = []
+
+        def updated(data):
+            if cancel.is_set():
+                return False
+            if data:
+                self.dataset_view.set_loading(
+                    True, f"all rows, {progress[-1]:.0%}")
+                return None
+
+            # the copy is done
+            self.browse_cancel = None
+            self.dataset_view.set_loading(self.loading_task is not None)
+            if errors:
+                self.dataset_view.set_status(errors[0])
+            else:
+                self.show_browse(corpus)
+            return False
 
-    def set_diff(self, rev1, rev2):
-        assert rev1 < len(self.loaded_data)
-        assert rev2 < len(self.loaded_data)
+        pipe = self.main_loop.watch_pipe(updated)
 
+        def report(fraction):
+            if progress and int(fraction * 100) == int(progress[-1] * 100):
+                return
+            progress.append(fraction)
+            try:
+                os.write(pipe, b"p")
+            except OSError:
+                pass
+
+        def build():
+            try:
+                corpus.build(report, cancel)
+            except BUILD_ERRORS as e:
+                errors.append(f"Could not copy the dataset: {e}")
+            finally:
+                os.close(pipe)
+
+        self.browse_cancel = cancel
+        self.dataset_view.set_loading(True, "all rows")
+        threading.Thread(target=build, daemon=True).start()
+
+    def stop_browse(self):
+        if self.browse_cancel is not None:
+            self.browse_cancel.set()
+            self.browse_cancel = None
+            self.dataset_view.set_loading(self.loading_task is not None)
+
+    def close_browse_rows(self):
+        """Close the rows of the dataset copy, once they are not shown"""
+        if self.corpus_rows is not None:
+            self.corpus_rows.close()
+            self.corpus_rows = None
+
+    def show_browse(self, corpus):
+        rows = corpus.open()
+        self.dataset_view.show(
+            rows, title=f"{self.dataset} (all {len(rows)} rows)",
+            searchable=False)
+        self.close_browse_rows()
+        self.corpus_rows = rows
+        self.showing = "browse"
+
+    def set_diff(self, rev1, rev2):
         assert rev1 < rev2 or rev2 == -1
         assert rev1 >= 0
 
         self.rev1 = rev1
         self.rev2 = rev2
 
-        if self.showing_diff:
+        # while loading, the range may not match the (stale) loaded data yet;
+        # the diff gets redrawn once the new data arrive.
+        if self.showing == "diff" and self.loading_task is None:
             self.show_diff()
 
     def show_diff(self):
+        if not self.loaded_data:
+            return
+
+        assert self.rev1 < len(self.loaded_data)
+        assert self.rev2 < len(self.loaded_data)
+
         rev1_data = self.loaded_data[self.rev1].stdout
         rev2_data = self.loaded_data[self.rev2].stdout
 
-        rev1_src = [item[self.langs[0]] for item in rev1_data]
-        rev1_tgt = [item[self.langs[1]] for item in rev1_data]
-        rev2_src = [item[self.langs[0]] for item in rev2_data]
-        rev2_tgt = [item[self.langs[1]] for item in rev2_data]
+        rev1_src = rev1_data.column(self.langs[0])
+        rev1_tgt = rev1_data.column(self.langs[1])
+        rev2_src = rev2_data.column(self.langs[0])
+        rev2_tgt = rev2_data.column(self.langs[1])
+
+        origins = self.get_origins()
 
         self.dataset_view.show_diff(
-            rev1_src, rev1_tgt, rev2_src, rev2_tgt, title=self.dataset)
+            rev1_src, rev1_tgt, rev2_src, rev2_tgt, title=self.dataset,
+            origins=(origins[self.rev1], origins[self.rev2]))
 
-        self.showing_diff = True
+        self.close_browse_rows()
+        self.showing = "diff"
+
+    def show_compare(self):
+        """Show the rows where the final outputs of the two variants of the
+        pipeline differ, rows of A as removed and rows of B as added"""
+        if not self.loaded_data or self.other_data is None:
+            return
+
+        a = self.loaded_data[-1].stdout, self.get_origins()[-1]
+        b = self.other_data[-1].stdout, self.get_other_origins()[-1]
+        if self.filter_list.variant == "B":
+            a, b = b, a
+        (a_data, a_origins), (b_data, b_origins) = a, b
+
+        only_a, only_b, both = compare_origins(a_origins, b_origins)
+
+        self.dataset_view.show_diff(
+            a_data.column(self.langs[0]), a_data.column(self.langs[1]),
+            b_data.column(self.langs[0]), b_data.column(self.langs[1]),
+            title=f"{self.dataset} (A/B: {only_a} rows only in A, "
+                  f"{only_b} only in B, {both} in both)",
+            origins=(a_origins, b_origins), changed_only=True)
+
+        self.close_browse_rows()
+        self.showing = "compare"
+
+    def _step_origins(self, outputs):
+        steps = [
+            bitext_rows(output.stdout.column(self.langs[0]),
+                        output.stdout.column(self.langs[1]))
+            for output in outputs]
+
+        origins = [list(range(len(steps[0])))]
+        for prev_rows, rows in zip(steps, steps[1:]):
+            origins.append(track_origins(prev_rows, origins[-1], rows))
+        return origins
+
+    def get_origins(self):
+        """Origins of the rows of each step in the raw sample.
+
+        Computed once per load, so that diffing any two steps is linear.
+        """
+        if self.origins is None:
+            self.origins = self._step_origins(self.loaded_data)
+        return self.origins
+
+    def get_other_origins(self):
+        """Same as `get_origins` for the other variant of the pipeline"""
+        if self.other_origins is None:
+            self.other_origins = self._step_origins(self.other_data)
+        return self.other_origins
+
+    def schedule_filters_update(self):
+        if self.dataset is None:
+            return
+
+        if self.main_loop is None:
+            self.apply_filters_update()
+            return
+
+        if self.filter_update_alarm is not None:
+            self.main_loop.remove_alarm(self.filter_update_alarm)
+
+        self.dataset_view.set_loading(True)
+        self.filter_update_alarm = self.main_loop.set_alarm_in(
+            FILTER_UPDATE_DELAY, self._filter_update_alarm)
+
+    def _filter_update_alarm(self, main_loop, user_data):
+        self.filter_update_alarm = None
+        self.apply_filters_update()
+
+    def flush_filters_update(self):
+        """Apply a scheduled filter update right away"""
+        if self.filter_update_alarm is None:
+            return
+
+        self.main_loop.remove_alarm(self.filter_update_alarm)
+        self.filter_update_alarm = None
+        self.apply_filters_update()
+
+    def apply_filters_update(self):
+        from opuscleaner.server import (
+            FilterPipelinePatch, api_update_dataset_filters)
+
+        if self.dataset:
+            self.update_data()
+            # variant B is only kept in the app until it is chosen
+            api_update_dataset_filters(
+                self.dataset,
+                FilterPipelinePatch(
+                    filters=list(self.filter_list.get_filters("A"))))
+
+    def redraw(self):
+        if self.main_loop is not None:
+            self.main_loop.draw_screen()
 
     def update_data(self):
-        self.loaded_data = asyncio.run(self.load_data())
+        # a newer pipeline makes the running one stale
+        if self.loading_task is not None:
+            self.loading_task.cancel()
+
+        self.dataset_view.set_loading(True)
+        self.loading_task = asyncio.ensure_future(self.load_data())
+        self.loading_task.add_done_callback(self.data_loaded)
+
+    def data_loaded(self, task):
+        if task is not self.loading_task:
+            return
+
+        self.loading_task = None
+        self.dataset_view.set_loading(False)
+
+        if task.exception() is not None:
+            self.openErrorDialog(str(task.exception()))
+            self.redraw()
+            return
+
+        results = task.result()
+        if results is not None:
+            results, origins, filters = results
+            self.set_results(*results, origins=origins, filters=filters)
+        self.redraw()
+
+    def set_results(self, results, other_results=None, reshow=False,
+                    origins=None, filters=None):
+        """Show the results of a pipeline run, and keep the results of the
+        other variant of the pipeline, if it is forked.
+
+        With `reshow`, the results are more rows of the ones shown, and the
+        view is kept as it is instead of going back to the clean data.
+        `origins` are the origins of the rows of each variant, if they were
+        tracked already (see `get_origins`). `filters` are the steps the
+        results are of, their statistics are only shown if the filters were
+        not edited since (see `FilterList.set_stats`).
+        """
+        self.loaded_data = [output for output, _ in results]
+        self.origins = origins[0] if origins else None
+        self.filter_list.set_stats(
+            [stats for _, stats in results[1:]], filters)
+
+        self.other_data = None
+        self.other_origins = None
+        if other_results is not None:
+            self.other_data = [output for output, _ in other_results]
+            if origins:
+                self.other_origins = origins[1]
 
         for i in range(len(self.loaded_data)):
             if self.loaded_data[i].returncode != 0:
                 self.openErrorDialog(self.loaded_data[i].stderr)
                 return
 
-        self.set_diff(0, -1)
-        self.show_clean()
+        if self.other_data is not None \
+                and self.other_data[-1].returncode != 0:
+            variant = self.filter_list.other_variant
+            self.openErrorDialog(
+                f"Variant {variant}: {self.other_data[-1].stderr}")
+            self.other_data = None
+
+        if not reshow:
+            # not shown yet, the clean data are shown below
+            self.rev1, self.rev2 = 0, -1
+
+        if self.showing == "browse":
+            # the whole dataset does not change with the filters
+            return
+
+        if self.showing == "compare" and self.other_data is None:
+            self.showing = "clean"
+
+        if not reshow and self.showing != "compare":
+            self.show_clean()
+            return
+
+        focus = self.dataset_view.datacols.body.focus
+        {"orig": self.show_orig, "clean": self.show_clean,
+         "diff": self.show_diff, "compare": self.show_compare}[self.showing]()
+        rows = self.dataset_view.datacols.body
+        if len(rows):
+            self.dataset_view.datacols.set_focus(min(focus, len(rows) - 1))
+
+    async def stop_loading(self):
+        task, self.loading_task = self.loading_task, None
+        if task is None:
+            return
+
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def get_row_sample(self):
+        sample_class = RandomSample if self.sample_random else HeadSample
+        if type(self.row_sample) is sample_class \
+                and self.row_sample.dataset == self.dataset \
+                and self.row_sample.is_current():
+            return self.row_sample
+
+        if self.row_sample is not None:
+            self.row_sample.close()
+        self.row_sample = sample_class(self.dataset)
+        return self.row_sample
 
     async def load_data(self):
         filters = list(self.filter_list.get_filters())
-        sample = get_sample(self.dataset, filters)
-        return [ParsedFilterOutput(f) async for f in sample]
+
+        # a forked pipeline runs alongside, on the same sample
+        variants = [filters]
+        if self.filter_list.other_filters is not None:
+            variants.append(list(self.filter_list.get_filters(
+                self.filter_list.other_variant)))
+
+        async def track(results):
+            # in a thread, as tracking the origins of a large sample takes
+            # a while (within the budgets of `track_origins`)
+            return [await asyncio.to_thread(
+                        self._step_origins,
+                        [output for output, _ in variant_results])
+                    for variant_results in results]
+
+        if self.sample_size is None:
+            results = await run_variants(
+                self.dataset, variants, self.step_cache)
+            return results, await track(results), filters
+
+        # show the results as they grow, the last ones included
+        sample = run_variants_progressive(
+            self.get_row_sample(), variants, self.step_cache,
+            self.sample_size)
+
+        reshow = False
+        async for results in sample:
+            rows = len(results[0][0][0].stdout)
+            self.dataset_view.set_loading(
+                True, f"{rows} of {self.sample_size} rows")
+            self.set_results(*results, reshow=reshow,
+                             origins=await track(results), filters=filters)
+            self.redraw()
+            reshow = True
+
+        return None
@@ -0,0 +1,62 @@
+import urwid
+
+from opuscleaner.config import SAMPLE_SIZE
+
+from clianer.widgets.button import CustomButton
+from clianer.widgets.dialog import Dialog
+
+
+class SampleSizeDialog(Dialog):
+    """Dialog for the number of rows the pipeline is run on.
+
+    Closes with the new size (0 for OpusCleaner's sample) and whether the
+    rows are random, or None if cancelled.
+    """
+
+    def __init__(self, current=None, random=False):
+        self.edit = urwid.IntEdit(
+            ("dialog edit caption", "Rows: "), current or "")
+        self.random = urwid.CheckBox("Random rows from the whole dataset",
+                                     random)
+
+        self.help = urwid.Text(
+            "Load this many rows from the start of the dataset. The first "
+            "few hundred are shown while the rest is being filtered. Random "
+            "rows need an index of the dataset files, built by reading them "
+            "whole the first time.\n\n"
+            "Leave empty to use OpusCleaner's sample instead "
+            f"({SAMPLE_SIZE} rows each from the start, the middle and the "
+            "end).")
+
+        self.ok_button = CustomButton("OK", on_press=self.save)
+        self.cancel_button = CustomButton("Cancel", on_press=self.cancel)
+        self.buttons = urwid.Padding(
+            urwid.Columns([self.ok_button, self.cancel_button], 4), "center")
+
+        self.top = urwid.ListBox([
+            self.help,
+            urwid.Divider(),
+            urwid.AttrMap(self.edit, "dialog edit", "dialog edit focus"),
+            urwid.AttrMap(self.random, "dialog body", "dialog edit focus"),
+            urwid.Divider(),
+            self.buttons])
+        self.top.set_focus(2)
+
+        urwid.register_signal(self.__class__, ["close"])
+        super().__init__(self.top, "Sample size", width=60, height=15)
+
+    def keypress(self, size, key):
+        if key == "enter":
+            focus = self.top.get_focus_widgets()[-1]
+            if focus == self.cancel_button:
+                self.cancel(None)
+            else:
+                self.save(None)
+        else:
+            return super().keypress(size, key)
+
+    def save(self, button):
+        self._emit("close", self.edit.value() or 0, self.random.get_state())
+
+    def cancel(self, button):
+        self._emit("close", None)
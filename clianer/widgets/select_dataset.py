@@ -1,60 +1,168 @@
+import os
+import threading
+
 import urwid
 
 from clianer.widgets.dialog import Dialog
 from clianer.widgets.button import CustomButton
+from clianer.util.catalogue import get_catalogue
 
-from opuscleaner.config import DATA_PATH
-from opuscleaner.datasets import list_datasets
-from opuscleaner.server import api_get_dataset_filters
-from opuscleaner.categories import get_mapping
 
 class SelectDatasetDialog(Dialog):
+    """Dialog listing the datasets of the catalogue.
 
-    def __init__(self, title="Select dataset", current=None):
-        # datasets: Dict[str, List[Tuple[str, Path]]]
-        self.datasets = list_datasets(DATA_PATH)
-        category_mapping = get_mapping()
-        focus_index = 0
-        have_mapping = []
-        for cat in category_mapping.categories:
-            if cat.name in category_mapping.mapping:
-                have_mapping.extend(category_mapping.mapping[cat.name])
+    With a `main_loop`, the dialog opens with the datasets known from the
+    last time and the catalogue is refreshed in a background thread, filling
+    in the list as it goes. Without one, it is refreshed before opening.
+    """
+
+    def __init__(self, title="Select dataset", current=None, main_loop=None):
+        self.current = current
+        self.main_loop = main_loop
+        self.entries = []
+        self.cancel = None
+
+        self.walker = urwid.SimpleFocusListWalker([])
+        self.listbox = urwid.ListBox(self.walker)
+        self.empty = urwid.Filler(
+            urwid.Text("No datasets found. Adjust $DATA_PATH maybe?"),
+            valign="top",
+            height="pack")
+
+        # dataset name -> languages in the order of the columns
+        self.datasets = {}
+
+        self.search = urwid.Edit("Filter: ")
+        urwid.connect_signal(
+            self.search, "postchange", lambda *args: self.show_entries())
+        self.status = urwid.Text("", align="right")
+
+        self.frame = urwid.Frame(
+            self.listbox, header=urwid.AttrMap(self.search, "dialog edit"),
+            footer=self.status)
+
+        urwid.register_signal(self.__class__, ["close"])
+        super().__init__(self.frame, title, width=70, height=30)
+
+        urwid.connect_signal(self, "close", lambda *args: self.stop_scan())
+        self.populate()
+
+    def populate(self, force=False):
+        catalogue = get_catalogue()
+
+        if self.main_loop is None:
+            self.set_entries(catalogue.refresh(force=force))
+            self.set_scanning(False)
+            return
+
+        self.set_entries(catalogue.entries())
+        self.start_scan(force)
+
+    def start_scan(self, force):
+        self.stop_scan()
+        self.set_scanning(True)
 
-        have_mapping = set(have_mapping)
+        cancel = threading.Event()
+        # only the latest state matters, the worker replaces it
+        latest = [None]
+        latest_lock = threading.Lock()
 
-        self.dataset_widgets = []
-        for dataset_name in self.datasets:
-            langs = ", ".join(
-                sorted(lang for lang, _ in self.datasets[dataset_name]))
+        def updated(data):
+            if cancel.is_set():
+                return False
+            with latest_lock:
+                entries, latest[0] = latest[0], None
+            if entries is not None:
+                self.set_entries(entries)
+            if not data:
+                # the worker closed the pipe, it is done
+                self.set_scanning(False)
+            return None
 
-            label = f"{dataset_name} ({langs})"
+        pipe = self.main_loop.watch_pipe(updated)
 
-            pipeline = api_get_dataset_filters(dataset_name)
-            if pipeline.filters:
-                label += f" [{len(pipeline.filters)}]"
+        def scan():
+            scanning = get_catalogue().refresh_iter(force)
+            try:
+                for entries in scanning:
+                    if cancel.is_set():
+                        break
+                    with latest_lock:
+                        latest[0] = entries
+                    try:
+                        os.write(pipe, b"u")
+                    except OSError:
+                        # the dialog stopped watching
+                        break
+            finally:
+                scanning.close()
+                os.close(pipe)
 
-            if dataset_name in have_mapping:
+        self.cancel = cancel
+        threading.Thread(target=scan, daemon=True).start()
+
+    def stop_scan(self):
+        if self.cancel is not None:
+            self.cancel.set()
+            self.cancel = None
+
+    def set_scanning(self, scanning):
+        if scanning:
+            self.status.set_text("scanning datasets...")
+        else:
+            self.status.set_text("ctrl r: rescan the data directory")
+
+    def set_entries(self, entries):
+        self.entries = entries
+        self.datasets = {entry.name: entry.langs for entry in entries}
+        self.show_entries()
+
+    def show_entries(self):
+        """Show the entries matching the filter, keeping the focus"""
+        focused = self.walker.get_focus()[0]
+        focused = focused.user_data if focused is not None else self.current
+
+        needle = self.search.edit_text.lower()
+
+        focus_index = 0
+        buttons = []
+        for entry in self.entries:
+            if needle not in entry.name.lower():
+                continue
+
+            label = f"{entry.name} ({', '.join(sorted(entry.langs))})"
+            if entry.filter_count:
+                label += f" [{entry.filter_count}]"
+
+            if entry.categorized:
                 label = f"* {label}"
 
+            if entry.name == focused:
+                focus_index = len(buttons)
             button = CustomButton(
-                label, on_press=self.select_dataset, user_data=dataset_name)
-
-            if current is not None and current == dataset_name:
-                focus_index = len(self.dataset_widgets)
-            self.dataset_widgets.append(button)
+                label, on_press=self.select_dataset, user_data=entry.name)
+            button.user_data = entry.name
+            buttons.append(button)
 
-        self.listbox = urwid.ListBox(self.dataset_widgets)
-        if self.dataset_widgets:
-            self.listbox.set_focus(focus_index)
+        self.walker[:] = buttons
+        if buttons:
+            self.walker.set_focus(focus_index)
+            self.frame.body = self.listbox
         else:
-            self.listbox = urwid.Filler(
-                urwid.Text("No datasets found. Adjust $DATA_PATH maybe?"),
-                valign="top",
-                height="pack")
+            self.frame.body = self.empty
 
-        urwid.register_signal(self.__class__, ["close"])
-        super().__init__(self.listbox, title, width=70, height=30)
+    def keypress(self, size, key):
+        if key == "ctrl r":
+            self.populate(force=True)
+            return None
+
+        # typing goes to the filter, whatever has the focus
+        if key == "backspace" or (len(key) == 1 and key.isprintable()
+                                  and key != " "):
+            self.search.keypress((size[0],), key)
+            return None
+
+        return super().keypress(size, key)
 
     def select_dataset(self, button, dataset):
-        self._emit(
-            "close", (dataset, [lang for lang, _ in self.datasets[dataset]]))
+        self._emit("close", (dataset, self.datasets[dataset]))
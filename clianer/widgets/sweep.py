@@ -0,0 +1,169 @@
+import urwid
+
+from opuscleaner.filters import FilterParameterInt
+
+from clianer.widgets.button import CustomButton
+
+
+# Number of values of a sweep, by default and at most
+DEFAULT_STEPS = 5
+MAX_STEPS = 20
+
+# Width of the bars showing the fraction of rows kept with each value
+BAR_WIDTH = 16
+
+
+def sweep_values(param, start, stop, count):
+    """`count` evenly spaced values from `start` to `stop`, within the limits
+    of the parameter and without repeats"""
+    if count < 2 or start == stop:
+        values = [start]
+    else:
+        values = [start + (stop - start) * i / (count - 1)
+                  for i in range(count)]
+
+    if param.min is not None:
+        values = [max(value, param.min) for value in values]
+    if param.max is not None:
+        values = [min(value, param.max) for value in values]
+
+    if isinstance(param, FilterParameterInt):
+        values = [round(value) for value in values]
+    else:
+        values = [float(f"{value:.6g}") for value in values]
+
+    return list(dict.fromkeys(values))
+
+
+def _bar(fraction):
+    full = round(fraction * BAR_WIDTH)
+    return "█" * full + "·" * (BAR_WIDTH - full)
+
+
+class SweepPanel(urwid.WidgetWrap):
+    """Runs a filter with a range of values of one of its numeric parameters
+    and shows how many rows it keeps with each.
+
+    Emits "run" with the values to run the filter with, "pick" with the value
+    chosen from the results, and "back".
+    """
+
+    def __init__(self, name, param, current=""):
+        self.name = name
+        self.param = param
+        self.values = []
+
+        # `current` is the text of the editor of the parameter
+        current = self._number(current)
+        start = param.min if param.min is not None else 0
+        if param.max is not None:
+            stop = param.max
+        elif current:
+            stop = current * 2
+        else:
+            stop = 10 if isinstance(param, FilterParameterInt) else 1.0
+
+        self.start_edit = self._number_edit("From: ", start)
+        self.stop_edit = self._number_edit("To: ", stop)
+        self.steps_edit = urwid.IntEdit(
+            ("dialog edit caption", "Steps: "), DEFAULT_STEPS)
+        self.edits = [
+            urwid.AttrMap(edit, "dialog edit", "dialog edit focus")
+            for edit in [self.start_edit, self.stop_edit, self.steps_edit]]
+
+        self.run_button = CustomButton("Run", on_press=self.run)
+        self.back_button = CustomButton(
+            "Back", on_press=lambda button: self._emit("back"))
+        self.status = urwid.Text("")
+
+        self.walker = urwid.SimpleFocusListWalker([
+            urwid.Text(
+                f"Run the filter with each value of {name} in the range, "
+                "all at once, on the output of the filters before it. Pick "
+                "a value from the results to use it."),
+            urwid.Divider(),
+            *self.edits,
+            urwid.Divider(),
+            urwid.Padding(
+                urwid.Columns([self.run_button, self.back_button], 4),
+                "center"),
+            urwid.Divider(),
+            self.status])
+        self.results_start = len(self.walker)
+
+        self.top = urwid.ListBox(self.walker)
+        self.top.set_focus(2)
+
+        urwid.register_signal(self.__class__, ["run", "pick", "back"])
+        super().__init__(self.top)
+
+    def _number_edit(self, caption, value):
+        caption = ("dialog edit caption", caption)
+        if isinstance(self.param, FilterParameterInt):
+            return urwid.IntEdit(caption, value)
+        return urwid.Edit(caption, str(value))
+
+    def _number(self, text):
+        try:
+            if isinstance(self.param, FilterParameterInt):
+                return int(text)
+            return float(text)
+        except ValueError:
+            return None
+
+    def run(self, button):
+        start = self._number(self.start_edit.edit_text)
+        stop = self._number(self.stop_edit.edit_text)
+        count = self.steps_edit.value()
+        if start is None or stop is None or not count:
+            self.status.set_text("Enter the range and the number of steps.")
+            return
+
+        self.values = sweep_values(
+            self.param, start, stop, min(count, MAX_STEPS))
+        self.walker[self.results_start:] = []
+        self.status.set_text("Running...")
+        self._emit("run", self.values)
+
+    def show_results(self, results):
+        """Show the `SweepResult` of each value"""
+        rows = [urwid.Text(
+            f" {'value':>10}  {'kept':>6}  {'':{BAR_WIDTH}}  {'rows':>7}")]
+
+        for value, result in zip(self.values, results):
+            if result.stats is None:
+                error = (result.error or "").strip().splitlines()
+                rows.append(urwid.Text(
+                    f" {value!s:>10}  failed: {error[-1] if error else ''}"))
+                continue
+
+            kept = 1 - result.stats.drop_rate
+            rows.append(CustomButton(
+                f"{value!s:>10}  {kept:6.1%}  {_bar(kept)}  "
+                f"{result.stats.output_lines:>7}",
+                on_press=self.pick, user_data=value))
+
+        self.walker[self.results_start:] = rows
+
+    def finished(self, error=None):
+        if error is not None:
+            self.status.set_text(f"Error: {error}")
+        elif any(isinstance(w, CustomButton)
+                 for w in self.walker[self.results_start:]):
+            self.status.set_text("Pick a value to use it:")
+        else:
+            self.status.set_text("")
+
+    def pick(self, button, value):
+        self._emit("pick", value)
+
+    def keypress(self, size, key):
+        if key == "esc":
+            self._emit("back")
+            return None
+
+        if key == "enter" and self.top.focus in self.edits:
+            self.run(None)
+            return None
+
+        return super().keypress(size, key)
@@ -1,10 +1,22 @@
 #!/usr/bin/env python3
 
 import argparse
+import sys
+from clianer import batch
 from clianer.app import App
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser(
+        "run", help="run the saved filter pipelines over whole datasets "
+        "without starting the app")
+    batch.add_arguments(run_parser)
+
     args = parser.parse_args()
 
+    if args.command == "run":
+        sys.exit(batch.run(args))
+
     App(args).run()
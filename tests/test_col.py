@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+COL_PY = os.path.join(
+    os.path.dirname(__file__), os.pardir, "clianer", "util", "col.py")
+
+
+def make_input(lines=200000):
+    rows = []
+    for i in range(lines):
+        rows.append(f"src {i} {'w' * (i % 61)}\ttgt {i} here\textra {i}\n")
+    return "".join(rows).encode()
+
+
+class ColTest(unittest.TestCase):
+    """col.py gives the same output as running the command on the whole
+    column, however the input is batched"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data = make_input()
+        fd, cls.path = tempfile.mkstemp(suffix=".tsv")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(cls.data)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.unlink(cls.path)
+
+    def expected(self, columns, command):
+        rows = [line.split(b"\t") for line in self.data.splitlines()]
+        column_input = b"".join(
+            row[column] + b"\n" for row in rows for column in columns)
+        output = iter(subprocess.run(
+            command, input=column_input, stdout=subprocess.PIPE,
+            check=True).stdout.splitlines())
+        for row in rows:
+            for column in columns:
+                row[column] = next(output)
+        return b"".join(b"\t".join(row) + b"\n" for row in rows)
+
+    def run_col(self, options, columns, command):
+        with open(self.path, "rb") as fin:
+            return subprocess.run(
+                [sys.executable, COL_PY, *options,
+                 ",".join(map(str, columns)), *command],
+                stdin=fin, stdout=subprocess.PIPE, check=True,
+                timeout=60).stdout
+
+    def test_same_output(self):
+        command = ["sed", "s/[0-9]/#/"]
+        for columns in [[0], [1], [0, 2]]:
+            expected = self.expected(columns, command)
+            for options in [
+                    [],
+                    ["--jobs", "4"],
+                    ["--jobs", "4", "--mmap"],
+                    # the cap is smaller than a batch per job
+                    ["--jobs", "4", "--max-memory", "1M"],
+                    ["--jobs", "8", "--max-memory", "1200K", "--mmap"],
+                    ["--jobs", "1", "--max-memory", "256K"]]:
+                with self.subTest(columns=columns, options=options):
+                    self.assertEqual(
+                        self.run_col(options, columns, command), expected)
+
+    def test_max_memory_too_small(self):
+        with open(self.path, "rb") as fin:
+            process = subprocess.run(
+                [sys.executable, COL_PY, "--jobs", "4", "--max-memory", "100K",
+                 "0", "cat"],
+                stdin=fin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                timeout=60)
+        self.assertEqual(process.returncode, 2)
+        self.assertIn(b"--max-memory", process.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import random
+import unittest
+from unittest import mock
+
+from clianer.util import diff
+from clianer.util.diff import DIFF_ENGINES
+
+
+WORDS = "the of and to in is that for it as was with be by on not".split()
+
+
+def sentence(rng):
+    return " ".join(rng.choices(WORDS, k=12)).capitalize() + "."
+
+
+def make_revisions(rng, size=2000):
+    """Rows and a revision of them with rows removed, modified and added"""
+    rows = [f"{sentence(rng)}\t{sentence(rng)}" for _ in range(size)]
+    revised = []
+    for row in rows:
+        p = rng.random()
+        if p < 0.1:
+            continue
+        if p < 0.3:
+            row = row.replace(" ", "  ", 1)
+        if p < 0.4:
+            row = row.upper()
+        revised.append(row)
+        if rng.random() < 0.02:
+            revised.append(f"{sentence(rng)}\t{sentence(rng)}")
+    return rows, revised
+
+
+class DiffEngineTest(unittest.TestCase):
+    """The lines of a diff give back both of the compared revisions"""
+
+    def assertReconstructs(self, engine, a, b):
+        difflines = list(engine(a, b))
+        self.assertEqual(
+            [line[2:] for line in difflines if line[:2] in ("  ", "- ")], a)
+        self.assertEqual(
+            [line[2:] for line in difflines if line[:2] in ("  ", "+ ")], b)
+
+    def test_reconstructs(self):
+        rng = random.Random(1)
+        for name, engine in DIFF_ENGINES.items():
+            with self.subTest(engine=name):
+                self.assertReconstructs(engine, *make_revisions(rng, 300))
+
+    def test_reconstructs_patience(self):
+        rng = random.Random(2)
+        a, b = make_revisions(rng)
+        self.assertReconstructs(diff.patience_engine, a, b)
+        self.assertReconstructs(diff.patience_engine, b, a)
+        self.assertReconstructs(diff.patience_engine, a, [])
+        self.assertReconstructs(diff.patience_engine, [], b)
+
+    def test_reconstructs_over_budget(self):
+        rng = random.Random(3)
+        with mock.patch.object(diff, "FUZZY_PAIR_TIME_BUDGET", 0):
+            self.assertReconstructs(diff.patience_engine, *make_revisions(rng))
+
+
+if __name__ == "__main__":
+    unittest.main()
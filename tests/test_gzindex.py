@@ -0,0 +1,65 @@
+import gzip
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from clianer.util import gzindex
+from clianer.util.gzindex import LINE_SPACING, MAX_SKIP_LINES, LineIndex
+
+
+LINES = [f"line {i}\n".encode() for i in range(20 * LINE_SPACING)]
+
+# Sparse enough that every jump is longer than MAX_SKIP_LINES
+WANTED = list(range(5, len(LINES), MAX_SKIP_LINES + 777))
+
+
+class LineIndexTest(unittest.TestCase):
+    """Lines read through the index are the lines of the file"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(gzindex, "CACHE_PATH", self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "wb") as fh:
+            fh.write(data)
+        return path
+
+    def read_lines(self, path, numbers):
+        index = LineIndex(path)
+        index.build()
+        with mock.patch.object(LineIndex, "_open_at", autospec=True,
+                               side_effect=LineIndex._open_at) as open_at:
+            lines = list(index.read_lines(numbers))
+        return lines, open_at.call_count
+
+    def test_uncompressed_opened_once(self):
+        path = self.write("data.txt", b"".join(LINES))
+        lines, opens = self.read_lines(path, WANTED)
+        self.assertEqual(lines, [LINES[i] for i in WANTED])
+        self.assertEqual(opens, 1)
+
+    def test_members(self):
+        # a gzip member every 3000 lines, as bgzip or pigz -i write them
+        data = b"".join(gzip.compress(b"".join(LINES[i:i + 3000]))
+                        for i in range(0, len(LINES), 3000))
+        path = self.write("data.txt.gz", data)
+        lines, opens = self.read_lines(path, WANTED)
+        self.assertEqual(lines, [LINES[i] for i in WANTED])
+        self.assertLess(opens, len(WANTED))
+
+    def test_single_stream(self):
+        path = self.write("data.txt.gz", gzip.compress(b"".join(LINES)))
+        with mock.patch.object(gzindex, "indexed_gzip", None):
+            lines, opens = self.read_lines(path, WANTED)
+        self.assertEqual(lines, [LINES[i] for i in WANTED])
+        self.assertEqual(opens, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
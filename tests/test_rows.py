@@ -0,0 +1,42 @@
+import unittest
+
+from clianer.util.rows import RowStore
+
+
+OUTPUTS = [
+    b"",
+    b"a\tb\n",
+    b"a\tb\nc\td\na\tb\n",
+    b"no\tnewline\nat the end",
+    b"carriage\treturn\r\nline\tfeed\n",
+    b"invalid\t\xff\xfe utf-8\n",
+    b"\n\n",
+]
+
+
+class RowStoreTest(unittest.TestCase):
+    """Outputs are given back as they were added"""
+
+    def test_to_bytes(self):
+        store = RowStore(["en", "ga"])
+        for data in OUTPUTS:
+            with self.subTest(data=data):
+                self.assertEqual(store.add(data).to_bytes(), data)
+
+    def test_shared_rows(self):
+        store = RowStore(["en", "ga"])
+        rows = store.add(b"a\tb\nc\td\n")
+        self.assertEqual(len(store.add(b"c\td\na\tb\n")), 2)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(rows[1], {"en": "c", "ga": "d"})
+
+    def test_concat(self):
+        first, second = RowStore(["en"]), RowStore(["en"])
+        rows = first.add(b"a\nb\n") + second.add(b"b\nc\xff")
+        self.assertIs(rows.store, first)
+        self.assertEqual(rows.to_bytes(), b"a\nb\nb\nc\xff")
+        self.assertEqual(len(first), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()